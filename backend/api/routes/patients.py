@@ -1,46 +1,138 @@
 from fastapi import APIRouter, HTTPException, status
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional, Set
 import os
-import json
-from datetime import datetime
+import asyncio
+import mmap
+import pathlib
+import orjson
+from datetime import datetime, timezone
+from loguru import logger
 
 router = APIRouter()
 
-PROJECT_ROOT = '/home/mbrq/Documents/RADOX'
-DATA_PATH = os.path.join(PROJECT_ROOT, 'data/patients.json')
+# Raíz del proyecto resuelta una vez desde este fichero, sin rutas fijas
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[3]
+DATA_PATH = str(PROJECT_ROOT / 'data' / 'patients.jsonl')
+LEGACY_DATA_PATH = str(PROJECT_ROOT / 'data' / 'patients.json')
 
 class Patient(BaseModel):
+    # Sin frozen: create_patient reasigna fecha_registro tras validar
+    model_config = ConfigDict(extra="forbid")
+
     id: str = Field(..., description="ID único del paciente")
     nombre: str
     edad: Optional[int] = None
     genero: Optional[str] = None
     fecha_registro: str
 
-def load_patients() -> List[dict]:
-    if not os.path.exists(DATA_PATH):
+# Cache en memoria de pacientes: el disco solo se lee en frío y cada alta
+# se apendiza en background (JSONL), sin reescribir el fichero completo
+_cache: Optional[List[dict]] = None
+_id_index: Set[str] = set()
+_pending: List[dict] = []
+_mtime_ns = 0
+_lock = asyncio.Lock()
+_flush_task: Optional[asyncio.Task] = None
+
+def _migrate_legacy_file() -> List[dict]:
+    """Migrar el antiguo data/patients.json (lista JSON) a JSONL"""
+    try:
+        with open(LEGACY_DATA_PATH, 'rb') as f:
+            patients = orjson.loads(f.read())
+    except Exception as e:
+        logger.error(f"Error migrando {LEGACY_DATA_PATH}: {e}")
+        return []
+    # tmp + os.replace: un lector concurrente nunca ve el fichero a medias
+    tmp_path = DATA_PATH + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for patient in patients:
+            f.write(orjson.dumps(patient) + b"\n")
+    os.replace(tmp_path, DATA_PATH)
+    return patients
+
+def _read_patients_file() -> List[dict]:
+    if not os.path.exists(DATA_PATH) and os.path.exists(LEGACY_DATA_PATH):
+        return _migrate_legacy_file()
+    try:
+        with open(DATA_PATH, 'rb') as f:
+            # mmap de longitud 0 lanza ValueError; el fichero vacío es un
+            # estado legítimo (migración de un patients.json vacío)
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            # orjson parsea directamente desde el buffer mapeado, sin copia
+            with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+                patients = []
+                for line in iter(mm.readline, b''):
+                    if not line.strip():
+                        continue
+                    try:
+                        patients.append(orjson.loads(line))
+                    except Exception as e:
+                        # Línea rota (append interrumpido): se salta sin
+                        # descartar el resto del fichero
+                        logger.warning(f"Línea inválida en {DATA_PATH}, ignorada: {e}")
+                return patients
+    except FileNotFoundError:
         return []
-    with open(DATA_PATH, 'r') as f:
+    except Exception as e:
+        logger.error(f"Error leyendo {DATA_PATH}: {e}")
+        return []
+
+def _append_patients_file(data: bytes):
+    with open(DATA_PATH, 'ab') as f:
+        f.write(data)
+
+async def load_patients() -> List[dict]:
+    global _cache, _id_index, _mtime_ns
+    async with _lock:
         try:
-            return json.load(f)
-        except Exception:
-            return []
+            mtime_ns = os.stat(DATA_PATH).st_mtime_ns
+        except OSError:
+            mtime_ns = 0
+        # Reparsear solo en frío o si el fichero cambió en disco
+        # (sin pisar altas pendientes de flush)
+        if _cache is None or (not _pending and mtime_ns != _mtime_ns):
+            _cache = await asyncio.to_thread(_read_patients_file)
+            _id_index = {p['id'] for p in _cache}
+            _mtime_ns = mtime_ns
+        return _cache
+
+async def _flush():
+    global _flush_task, _mtime_ns
+    async with _lock:
+        if not _pending:
+            _flush_task = None
+            return
+        data = b"".join(orjson.dumps(p) + b"\n" for p in _pending)
+        _pending.clear()
+        _flush_task = None
+    await asyncio.to_thread(_append_patients_file, data)
+    try:
+        _mtime_ns = os.stat(DATA_PATH).st_mtime_ns
+    except OSError:
+        pass
 
-def save_patients(patients: List[dict]):
-    with open(DATA_PATH, 'w') as f:
-        json.dump(patients, f, indent=2, ensure_ascii=False)
+async def save_patient(record: dict):
+    global _flush_task
+    _pending.append(record)
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush())
 
 @router.get("/patients", response_model=List[Patient], summary="Listar pacientes")
 async def get_patients():
-    return load_patients()
+    return await load_patients()
 
 @router.post("/patients", response_model=Patient, summary="Crear paciente")
 async def create_patient(paciente: Patient):
-    pacientes = load_patients()
-    if any(p['id'] == paciente.id for p in pacientes):
+    pacientes = await load_patients()
+    if paciente.id in _id_index:
         raise HTTPException(status_code=400, detail="ID de paciente ya existe")
-    paciente.fecha_registro = datetime.now().isoformat()
-    pacientes.append(paciente.dict())
-    save_patients(pacientes)
-    return paciente 
\ No newline at end of file
+    # Precisión de segundos: evita formatear microsegundos en cada POST
+    paciente.fecha_registro = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    record = paciente.model_dump(mode="json")
+    pacientes.append(record)
+    _id_index.add(paciente.id)
+    await save_patient(record)
+    return paciente
@@ -3,26 +3,65 @@ Rutas de API para Detección de Neumonía
 Endpoints para subir imágenes y obtener predicciones de neumonía
 """
 
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, status
-from fastapi.responses import JSONResponse
-from typing import Optional, Dict, Any, List
-from pydantic import BaseModel, Field
-import json
+import asyncio
+
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Query, Request, status
+from backend.utils.orjson_response import ORJSONResponse
+from backend.utils.static_json import StaticJSON
+from typing import Optional, Dict, Any, List, Literal
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from loguru import logger
 
-from backend.utils.image_processing import validate_medical_image, ImageProcessor
+from backend.utils.image_processing import (
+    validate_medical_image,
+    ImageProcessor,
+    SUPPORTED_FORMATS as _FORMAT_TABLE,
+    DICOM_EXTENSIONS,
+)
 from backend.dependencies import get_detection_service
 
 router = APIRouter()
 
+# Metadata estática precomputada (se serializa una sola vez en el import)
+# La lista de formatos se deriva de la tabla compartida con la validación
+_FORMAT_DESCRIPTIONS = {
+    "jpg": "Imagen JPEG estándar",
+    "jpeg": "Imagen JPEG estándar",
+    "png": "Imagen PNG",
+    "dicom": "Imagen médica DICOM",
+    "dcm": "Imagen médica DICOM",
+}
+SUPPORTED_FORMATS = {
+    "supported_formats": [
+        {
+            "extension": ext,
+            "mime_type": mime,
+            "description": _FORMAT_DESCRIPTIONS[ext],
+            "max_size": f"{max_size >> 20}MB"
+        }
+        for ext, (mime, max_size) in _FORMAT_TABLE.items()
+    ],
+    "recommendations": [
+        "Use imágenes DICOM para mejor precisión diagnóstica",
+        "Asegúrese de que las imágenes tengan buena calidad y resolución",
+        "Las radiografías de tórax frontales (PA/AP) son las más adecuadas",
+        "Evite imágenes con marcas de agua o anotaciones superpuestas"
+    ]
+}
+_SUPPORTED_FORMATS_STATIC = StaticJSON(SUPPORTED_FORMATS)
+
 # Modelos Pydantic para validación
 class PatientInfo(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     age: Optional[int] = Field(None, ge=0, le=120, description="Edad del paciente")
-    gender: Optional[str] = Field(None, pattern="^(M|F|Male|Female|Masculino|Femenino)$", description="Sexo del paciente")
+    gender: Optional[Literal["M", "F", "Male", "Female", "Masculino", "Femenino"]] = Field(None, description="Sexo del paciente")
     symptoms: Optional[str] = Field(None, max_length=500, description="Síntomas del paciente")
     clinical_history: Optional[str] = Field(None, max_length=1000, description="Historia clínica relevante")
 
 class DetectionResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     case_id: str
     timestamp: str
     filename: str
@@ -31,11 +70,34 @@ class DetectionResponse(BaseModel):
     processing_info: Dict[str, Any]
 
 class DetectionRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     patient_info: Optional[PatientInfo] = None
     # include_similar_cases: bool = Field(default=True, description="Incluir casos similares en respuesta")  # Comentado
     # similarity_threshold: float = Field(default=0.7, ge=0.0, le=1.0, description="Umbral de similaridad")  # Comentado
     # max_similar_cases: int = Field(default=5, ge=1, le=10, description="Máximo número de casos similares")  # Comentado
 
+# Lectura de uploads en chunks: evita buffer completo antes de validar tamaño
+_UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+_MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB (límite DICOM)
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """
+    Leer un archivo subido en chunks desde el spool de Starlette
+
+    Aborta con 413 en cuanto el acumulado supera el límite, sin esperar
+    a buffear el cuerpo completo en memoria.
+    """
+    buffer = bytearray()
+    while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > _MAX_UPLOAD_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Archivo demasiado grande"
+            )
+    return bytes(buffer)
+
 @router.post(
     "/detect",
     response_model=DetectionResponse,
@@ -46,6 +108,7 @@ class DetectionRequest(BaseModel):
 async def detect_pneumonia(
     file: UploadFile = File(..., description="Archivo de imagen (JPG, PNG, DICOM)"),
     patient_info: Optional[str] = Form(None, description="Información del paciente en JSON"),
+    heatmap: bool = Query(True, description="Calcular heatmap Grad-CAM (heatmap=0 lo omite)"),
     # include_similar_cases: bool = Form(True, description="Incluir casos similares"),  # Comentado
     # similarity_threshold: float = Form(0.7, description="Umbral de similaridad"),  # Comentado
     # max_similar_cases: int = Form(5, description="Máximo número de casos similares"),  # Comentado
@@ -66,8 +129,8 @@ async def detect_pneumonia(
                 detail="Nombre de archivo requerido"
             )
         
-        # Leer datos del archivo
-        file_content = await file.read()
+        # Leer datos del archivo en chunks (corta uploads demasiado grandes)
+        file_content = await _read_upload(file)
         
         # Validar imagen médica
         validation_result = validate_medical_image(file_content, file.filename)
@@ -81,15 +144,14 @@ async def detect_pneumonia(
         patient_data = None
         if patient_info:
             try:
-                patient_data = json.loads(patient_info)
-                # Validar con Pydantic
-                PatientInfo(**patient_data)
-            except json.JSONDecodeError:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Formato JSON inválido en patient_info"
-                )
-            except Exception as e:
+                # Parseo + validación en una sola pasada (pydantic-core)
+                patient_data = PatientInfo.model_validate_json(patient_info).model_dump()
+            except ValidationError as e:
+                if any(err.get("type") == "json_invalid" for err in e.errors()):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Formato JSON inválido en patient_info"
+                    )
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Datos de paciente inválidos: {str(e)}"
@@ -100,7 +162,8 @@ async def detect_pneumonia(
         detection_result = await detection_service.detect_pneumonia(
             image_data=file_content,
             filename=file.filename,
-            patient_info=patient_data
+            patient_info=patient_data,
+            want_heatmap=heatmap
         )
         
         # Preparar respuesta (sin casos similares)
@@ -118,7 +181,7 @@ async def detect_pneumonia(
             # No fallar la respuesta por esto
         
         logger.success(f"Detección completada para caso: {detection_result.get('case_id')}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_200_OK,
             content=response_data
         )
@@ -134,6 +197,71 @@ async def detect_pneumonia(
 
 
 
+@router.post(
+    "/detect_batch",
+    summary="Detectar neumonía en varias radiografías",
+    description="Procesa un lote de imágenes en un único forward del modelo",
+    tags=["Detección"]
+)
+async def detect_pneumonia_batch(
+    files: List[UploadFile] = File(..., description="Archivos de imagen (JPG, PNG, DICOM)"),
+    heatmap: bool = Query(False, description="Calcular heatmap Grad-CAM por imagen (lento)"),
+    detection_service = Depends(get_detection_service)
+):
+    """
+    Detectar neumonía en un lote de radiografías
+
+    Las imágenes se lanzan concurrentemente y el micro-batcher las apila
+    en un único forward, amortizando el overhead ASGI/tensor por imagen.
+    El heatmap es opt-in: por imagen añade un forward con gradientes.
+    """
+    try:
+        if not files:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Se requiere al menos un archivo"
+            )
+
+        contents = []
+        for file in files:
+            if not file.filename:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Nombre de archivo requerido en todos los archivos"
+                )
+            file_content = await _read_upload(file)
+            validation_result = validate_medical_image(file_content, file.filename)
+            if not validation_result["is_valid"]:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Imagen no válida ({file.filename}): {', '.join(validation_result['errors'])}"
+                )
+            contents.append((file.filename, file_content))
+
+        logger.info(f"Procesando detección batch de {len(contents)} imágenes")
+        results = await asyncio.gather(*[
+            detection_service.detect_pneumonia(
+                image_data=content,
+                filename=filename,
+                want_heatmap=heatmap
+            )
+            for filename, content in contents
+        ])
+
+        return ORJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={"count": len(results), "results": results}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en detección batch: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error interno del servidor: {str(e)}"
+        )
+
 @router.get(
     "/validate-image",
     summary="Validar imagen médica",
@@ -157,10 +285,10 @@ async def validate_image_endpoint(
                 detail="Nombre de archivo requerido"
             )
         
-        file_content = await file.read()
+        file_content = await _read_upload(file)
         validation_result = validate_medical_image(file_content, file.filename)
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "filename": file.filename,
@@ -182,52 +310,13 @@ async def validate_image_endpoint(
     description="Lista los formatos de imagen soportados",
     tags=["Información"]
 )
-async def get_supported_formats():
+async def get_supported_formats(request: Request):
     """
     Obtener lista de formatos de imagen soportados
-    
+
     Retorna información sobre los formatos que acepta el sistema.
     """
-    return {
-        "supported_formats": [
-            {
-                "extension": "jpg",
-                "mime_type": "image/jpeg",
-                "description": "Imagen JPEG estándar",
-                "max_size": "10MB"
-            },
-            {
-                "extension": "jpeg", 
-                "mime_type": "image/jpeg",
-                "description": "Imagen JPEG estándar",
-                "max_size": "10MB"
-            },
-            {
-                "extension": "png",
-                "mime_type": "image/png", 
-                "description": "Imagen PNG",
-                "max_size": "10MB"
-            },
-            {
-                "extension": "dicom",
-                "mime_type": "application/dicom",
-                "description": "Imagen médica DICOM",
-                "max_size": "50MB"
-            },
-            {
-                "extension": "dcm",
-                "mime_type": "application/dicom",
-                "description": "Imagen médica DICOM",
-                "max_size": "50MB"
-            }
-        ],
-        "recommendations": [
-            "Use imágenes DICOM para mejor precisión diagnóstica",
-            "Asegúrese de que las imágenes tengan buena calidad y resolución",
-            "Las radiografías de tórax frontales (PA/AP) son las más adecuadas",
-            "Evite imágenes con marcas de agua o anotaciones superpuestas"
-        ]
-    }
+    return _SUPPORTED_FORMATS_STATIC.response(request)
 
 @router.get(
     "/statistics",
@@ -263,29 +352,42 @@ async def get_system_statistics(
             detail=f"Error al obtener estadísticas: {str(e)}"
         )
 
+# Recomendaciones precomputadas: cada combinación de flags de validación
+# mapea a una tupla de strings construida una sola vez en el import
+_REC_ERRORS = ("Corrija los errores antes de proceder con el análisis",)
+_REC_WARNINGS = (
+    "Revise las advertencias para obtener mejores resultados",
+    "Considere usar una imagen de mejor calidad si está disponible"
+)
+_REC_SMALL_DIMS = ("Para mejores resultados, use imágenes de al menos 512x512 píxeles",)
+_REC_NO_DICOM = ("Las imágenes DICOM proporcionan mejor información diagnóstica",)
+_REC_OK = ("La imagen es adecuada para análisis",)
+
+_REC_TABLE = {}
+for _flags in range(16):
+    _recs = ()
+    if _flags & 1:
+        _recs += _REC_ERRORS
+    if _flags & 2:
+        _recs += _REC_WARNINGS
+    if _flags & 4:
+        _recs += _REC_SMALL_DIMS
+    if _flags & 8:
+        _recs += _REC_NO_DICOM
+    _REC_TABLE[_flags] = _recs or _REC_OK
+
 def _get_validation_recommendations(validation_result: Dict[str, Any]) -> List[str]:
-    """Generar recomendaciones basadas en validación"""
-    recommendations = []
-    
-    if validation_result["errors"]:
-        recommendations.append("Corrija los errores antes de proceder con el análisis")
-    
-    if validation_result["warnings"]:
-        recommendations.extend([
-            "Revise las advertencias para obtener mejores resultados",
-            "Considere usar una imagen de mejor calidad si está disponible"
-        ])
-    
+    """Generar recomendaciones basadas en validación (tabla precomputada)"""
+    small_dims = False
     dimensions = validation_result.get("dimensions")
     if dimensions:
         height, width = dimensions[:2]
-        if height < 512 or width < 512:
-            recommendations.append("Para mejores resultados, use imágenes de al menos 512x512 píxeles")
-    
-    if validation_result["format"] not in ["dicom", "dcm"]:
-        recommendations.append("Las imágenes DICOM proporcionan mejor información diagnóstica")
-    
-    if not recommendations:
-        recommendations.append("La imagen es adecuada para análisis")
-    
-    return recommendations 
\ No newline at end of file
+        small_dims = height < 512 or width < 512
+
+    flags = (
+        bool(validation_result["errors"])
+        | (bool(validation_result["warnings"]) << 1)
+        | (small_dims << 2)
+        | ((validation_result["format"] not in DICOM_EXTENSIONS) << 3)
+    )
+    return list(_REC_TABLE[flags]) 
\ No newline at end of file
@@ -3,24 +3,162 @@ Rutas de API para Generación de Informes Médicos
 Endpoints para generar informes usando MedGemma y gestionar reportes
 """
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
-from fastapi.responses import JSONResponse
-from typing import Optional, Dict, Any, List
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Depends, Request, status, Query
+from backend.utils.orjson_response import ORJSONResponse
+from backend.utils.static_json import StaticJSON
+from typing import Optional, Dict, Any, List, Literal
+from pydantic import BaseModel, ConfigDict, Field
 from loguru import logger
+import re
 from backend.dependencies import get_report_service
 
 router = APIRouter()
 
+# Metadata estática precomputada (se serializa una sola vez en el import)
+REPORT_TEMPLATES = {
+    "templates": [
+        {
+            "id": "complete",
+            "name": "Informe Completo",
+            "description": "Informe médico completo con todas las secciones",
+            "sections": [
+                "Datos del Paciente",
+                "Técnica de Estudio",
+                "Hallazgos Radiológicos",
+                "Impresión Diagnóstica",
+                "Recomendaciones Clínicas",
+                "Notas Adicionales"
+            ],
+            "estimated_length": "500-800 palabras"
+        },
+        {
+            "id": "summary",
+            "name": "Resumen Ejecutivo",
+            "description": "Resumen conciso con hallazgos principales",
+            "sections": [
+                "Hallazgos Principales",
+                "Impresión Diagnóstica",
+                "Recomendaciones"
+            ],
+            "estimated_length": "200-400 palabras"
+        },
+        {
+            "id": "detailed",
+            "name": "Informe Detallado",
+            "description": "Informe extenso con análisis profundo",
+            "sections": [
+                "Información Completa del Paciente",
+                "Metodología de Análisis",
+                "Hallazgos Detallados",
+                "Análisis Comparativo",
+                "Impresión Diagnóstica Extendida",
+                "Recomendaciones Específicas",
+                "Seguimiento Propuesto"
+            ],
+            "estimated_length": "800-1200 palabras"
+        }
+    ],
+    "supported_languages": ["spanish", "english"],
+    "customization_options": [
+        "Incluir casos similares",
+        "Nivel de detalle técnico",
+        "Formato de presentación",
+        "Secciones opcionales"
+    ]
+}
+_TEMPLATES_STATIC = StaticJSON(REPORT_TEMPLATES)
+
+EXPORT_FORMATS = {
+    "formats": [
+        {
+            "format": "json",
+            "mime_type": "application/json",
+            "description": "Formato JSON estructurado",
+            "features": ["Datos estructurados", "Fácil integración", "Metadata completa"]
+        },
+        {
+            "format": "pdf",
+            "mime_type": "application/pdf",
+            "description": "Documento PDF formateado",
+            "features": ["Formato profesional", "Listo para imprimir", "Header/Footer personalizable"],
+            "status": "planned"
+        },
+        {
+            "format": "html",
+            "mime_type": "text/html",
+            "description": "Página HTML formateada",
+            "features": ["Visualización web", "Estilos personalizables", "Enlaces interactivos"],
+            "status": "planned"
+        },
+        {
+            "format": "docx",
+            "mime_type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            "description": "Documento Microsoft Word",
+            "features": ["Editable", "Formato profesional", "Compatible con Office"],
+            "status": "planned"
+        }
+    ],
+    "current_support": ["json"],
+    "planned_features": [
+        "Plantillas personalizables",
+        "Logos institucionales",
+        "Firmas digitales",
+        "Exportación batch"
+    ]
+}
+_EXPORT_FORMATS_STATIC = StaticJSON(EXPORT_FORMATS)
+
+QUALITY_METRICS = {
+    "quality_criteria": {
+        "completeness": {
+            "description": "Completitud del informe",
+            "weight": 0.4,
+            "factors": ["Número de palabras", "Secciones incluidas", "Detalle técnico"]
+        },
+        "structure": {
+            "description": "Estructura del informe",
+            "weight": 0.3,
+            "factors": ["Secciones identificadas", "Formato correcto", "Organización lógica"]
+        },
+        "accuracy": {
+            "description": "Precisión médica",
+            "weight": 0.3,
+            "factors": ["Consistencia con IA", "Terminología médica", "Recomendaciones apropiadas"]
+        }
+    },
+    "benchmarks": {
+        "excellent": "> 0.9",
+        "good": "0.7 - 0.9",
+        "acceptable": "0.5 - 0.7",
+        "needs_review": "< 0.5"
+    },
+    "improvement_suggestions": [
+        "Revisar informes con score < 0.7",
+        "Validar terminología médica",
+        "Verificar consistencia con detección IA",
+        "Incluir más contexto clínico cuando sea necesario"
+    ]
+}
+_QUALITY_METRICS_STATIC = StaticJSON(QUALITY_METRICS)
+
+# Secciones esperadas en un informe: una sola pasada de regex sobre el texto
+# original en vez de N búsquedas sobre una copia en mayúsculas
+_EXPECTED_SECTIONS = ["HALLAZGOS", "IMPRESIÓN", "RECOMENDACIONES"]
+_SECTIONS_RE = re.compile(r"(HALLAZGOS|IMPRESI[ÓO]N|RECOMENDACIONES)", re.IGNORECASE)
+
 # Modelos Pydantic para validación
 class ReportRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     case_id: str = Field(..., description="ID del caso para generar informe")
     detection_result: Dict[str, Any] = Field(..., description="Resultado de detección de neumonía")
     patient_info: Optional[Dict[str, Any]] = Field(None, description="Información adicional del paciente")
-    language: str = Field(default="spanish", pattern="^(spanish|english)$", description="Idioma del informe")
-    report_type: str = Field(default="complete", pattern="^(complete|summary|detailed)$", description="Tipo de informe")
+    language: Literal["spanish", "english"] = Field(default="spanish", description="Idioma del informe")
+    report_type: Literal["complete", "summary", "detailed"] = Field(default="complete", description="Tipo de informe")
 
 class ReportResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     report_id: str
     case_id: str
     timestamp: str
@@ -71,7 +209,7 @@ async def generate_medical_report(
         
         logger.success(f"Informe generado: {report_result.get('report_id')}")
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_200_OK,
             content=report_result
         )
@@ -129,63 +267,13 @@ async def get_report_by_id(
     description="Obtiene plantillas disponibles para informes médicos",
     tags=["Plantillas"]
 )
-async def get_report_templates():
+async def get_report_templates(request: Request):
     """
     Obtener plantillas de informes disponibles
-    
+
     Retorna lista de plantillas y formatos de informes soportados.
     """
-    return {
-        "templates": [
-            {
-                "id": "complete",
-                "name": "Informe Completo",
-                "description": "Informe médico completo con todas las secciones",
-                "sections": [
-                    "Datos del Paciente",
-                    "Técnica de Estudio", 
-                    "Hallazgos Radiológicos",
-                    "Impresión Diagnóstica",
-                    "Recomendaciones Clínicas",
-                    "Notas Adicionales"
-                ],
-                "estimated_length": "500-800 palabras"
-            },
-            {
-                "id": "summary",
-                "name": "Resumen Ejecutivo",
-                "description": "Resumen conciso con hallazgos principales",
-                "sections": [
-                    "Hallazgos Principales",
-                    "Impresión Diagnóstica",
-                    "Recomendaciones"
-                ],
-                "estimated_length": "200-400 palabras"
-            },
-            {
-                "id": "detailed",
-                "name": "Informe Detallado",
-                "description": "Informe extenso con análisis profundo",
-                "sections": [
-                    "Información Completa del Paciente",
-                    "Metodología de Análisis",
-                    "Hallazgos Detallados",
-                    "Análisis Comparativo",
-                    "Impresión Diagnóstica Extendida",
-                    "Recomendaciones Específicas",
-                    "Seguimiento Propuesto"
-                ],
-                "estimated_length": "800-1200 palabras"
-            }
-        ],
-        "supported_languages": ["spanish", "english"],
-        "customization_options": [
-            "Incluir casos similares",
-            "Nivel de detalle técnico",
-            "Formato de presentación",
-            "Secciones opcionales"
-        ]
-    }
+    return _TEMPLATES_STATIC.response(request)
 
 @router.get(
     "/export-formats",
@@ -193,50 +281,13 @@ async def get_report_templates():
     description="Lista formatos disponibles para exportar informes",
     tags=["Exportación"]
 )
-async def get_export_formats():
+async def get_export_formats(request: Request):
     """
     Obtener formatos de exportación disponibles
-    
+
     Retorna lista de formatos soportados para exportar informes.
     """
-    return {
-        "formats": [
-            {
-                "format": "json",
-                "mime_type": "application/json",
-                "description": "Formato JSON estructurado",
-                "features": ["Datos estructurados", "Fácil integración", "Metadata completa"]
-            },
-            {
-                "format": "pdf",
-                "mime_type": "application/pdf",
-                "description": "Documento PDF formateado",
-                "features": ["Formato profesional", "Listo para imprimir", "Header/Footer personalizable"],
-                "status": "planned"
-            },
-            {
-                "format": "html",
-                "mime_type": "text/html",
-                "description": "Página HTML formateada",
-                "features": ["Visualización web", "Estilos personalizables", "Enlaces interactivos"],
-                "status": "planned"
-            },
-            {
-                "format": "docx",
-                "mime_type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                "description": "Documento Microsoft Word",
-                "features": ["Editable", "Formato profesional", "Compatible con Office"],
-                "status": "planned"
-            }
-        ],
-        "current_support": ["json"],
-        "planned_features": [
-            "Plantillas personalizables",
-            "Logos institucionales",
-            "Firmas digitales",
-            "Exportación batch"
-        ]
-    }
+    return _EXPORT_FORMATS_STATIC.response(request)
 
 @router.get(
     "/quality-metrics",
@@ -244,43 +295,13 @@ async def get_export_formats():
     description="Obtiene métricas de calidad para informes generados",
     tags=["Calidad"]
 )
-async def get_quality_metrics():
+async def get_quality_metrics(request: Request):
     """
     Obtener métricas de calidad del sistema de informes
-    
+
     Retorna estadísticas sobre la calidad de los informes generados.
     """
-    return {
-        "quality_criteria": {
-            "completeness": {
-                "description": "Completitud del informe",
-                "weight": 0.4,
-                "factors": ["Número de palabras", "Secciones incluidas", "Detalle técnico"]
-            },
-            "structure": {
-                "description": "Estructura del informe",
-                "weight": 0.3,
-                "factors": ["Secciones identificadas", "Formato correcto", "Organización lógica"]
-            },
-            "accuracy": {
-                "description": "Precisión médica",
-                "weight": 0.3,
-                "factors": ["Consistencia con IA", "Terminología médica", "Recomendaciones apropiadas"]
-            }
-        },
-        "benchmarks": {
-            "excellent": "> 0.9",
-            "good": "0.7 - 0.9",
-            "acceptable": "0.5 - 0.7",
-            "needs_review": "< 0.5"
-        },
-        "improvement_suggestions": [
-            "Revisar informes con score < 0.7",
-            "Validar terminología médica",
-            "Verificar consistencia con detección IA",
-            "Incluir más contexto clínico cuando sea necesario"
-        ]
-    }
+    return _QUALITY_METRICS_STATIC.response(request)
 
 @router.post(
     "/validate-report",
@@ -331,14 +352,17 @@ async def validate_medical_report(
             elif word_count > 2000:
                 validation_results["suggestions"].append("Considerar resumir contenido")
             
-            # Verificar secciones
-            expected_sections = ["HALLAZGOS", "IMPRESIÓN", "RECOMENDACIONES"]
-            found_sections = [section for section in expected_sections if section in full_report.upper()]
-            
+            # Verificar secciones en una sola pasada
+            found = {
+                m.group(1).upper().replace("IMPRESION", "IMPRESIÓN")
+                for m in _SECTIONS_RE.finditer(full_report)
+            }
+            found_sections = [section for section in _EXPECTED_SECTIONS if section in found]
+
             validation_results["sections_analysis"] = {
-                "expected": expected_sections,
+                "expected": _EXPECTED_SECTIONS,
                 "found": found_sections,
-                "completeness": len(found_sections) / len(expected_sections)
+                "completeness": len(found_sections) / len(_EXPECTED_SECTIONS)
             }
         
         # Calcular score de calidad
@@ -346,7 +370,7 @@ async def validate_medical_report(
         length_score = min(len(full_report.split()) / 300, 1.0)
         validation_results["quality_score"] = (structure_score + length_score) / 2
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_200_OK,
             content=validation_results
         )
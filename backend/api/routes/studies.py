@@ -1,20 +1,48 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Path
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, status, Path
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import os
-import json
+import asyncio
+import pathlib
+import re
 from datetime import datetime
-import shutil
 import uuid
 
+from backend.config.settings import get_settings
+
+import orjson
+
+import aiofiles
+from loguru import logger
+
+# Tamaño de chunk para volcar uploads a disco (64KB+ amortiza el syscall)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Caracteres admitidos en nombres de archivo subidos; el resto se
+# sustituye por '_' para impedir rutas tipo '../'
+_FILENAME_SAFE_RE = re.compile(r'[^A-Za-z0-9._-]')
+
 router = APIRouter()
 
-PROJECT_ROOT = '/home/mbrq/Documents/RADOX'
-DATA_PATH = os.path.join(PROJECT_ROOT, 'data/studies.json')
-UPLOADS_PATH = os.path.join(PROJECT_ROOT, 'data/uploads')
-IMAGES_PATH = os.path.join(PROJECT_ROOT, 'data/uploads/images')
-REPORTS_PATH = os.path.join(PROJECT_ROOT, 'data/uploads/reports')
+# Raíz del proyecto resuelta una vez desde este fichero: funciona igual
+# en contenedores y en cualquier checkout, sin rutas absolutas fijas
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[3]
+DATA_PATH = str(PROJECT_ROOT / 'data' / 'studies.jsonl')
+LEGACY_DATA_PATH = str(PROJECT_ROOT / 'data' / 'studies.json')
+UPLOADS_PATH = str(PROJECT_ROOT / 'data' / 'uploads')
+IMAGES_PATH = str(PROJECT_ROOT / 'data' / 'uploads' / 'images')
+REPORTS_PATH = str(PROJECT_ROOT / 'data' / 'uploads' / 'reports')
+PARTS_PATH = str(PROJECT_ROOT / 'data' / 'uploads' / 'parts')
+
+# Crear los directorios de subida una sola vez en el import,
+# no en cada petición
+os.makedirs(IMAGES_PATH, exist_ok=True)
+os.makedirs(REPORTS_PATH, exist_ok=True)
+os.makedirs(PARTS_PATH, exist_ok=True)
+
+# Tamaño de parte sugerido al cliente para subidas multipart
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
 
 class Study(BaseModel):
     id: str = Field(..., description="ID único del estudio")
@@ -25,61 +53,175 @@ class Study(BaseModel):
     diagnostico: Optional[str] = None
     confianza: Optional[float] = None
 
-def load_studies() -> List[dict]:
+# Log JSONL append-only: cada alta es una línea, y los PATCH/DELETE se
+# registran como tombstones que load_studies pliega al leer (last-write-wins).
+# El coste de cada mutación es independiente del número de estudios.
+
+# Compactar cuando el log acumula este exceso de operaciones sobre estudios vivos
+COMPACT_SLACK = 256
+
+# Cache en memoria del estado plegado: el log solo se relee si el fichero
+# cambió en disco; las mutaciones actualizan cache y log a la vez
+_cache: Optional[List[dict]] = None
+_by_patient: dict = {}
+_mtime_ns = 0
+_lock = asyncio.Lock()
+
+def _write_log_atomic(studies: List[dict]):
+    """Reescribir el log completo vía tmp + os.replace (rename atómico)
+
+    Un lector concurrente nunca ve el fichero truncado a medias: o lee la
+    versión anterior o la nueva, completas.
+    """
+    data = b''.join(orjson.dumps(s) + b'\n' for s in studies)
+    tmp_path = DATA_PATH + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, DATA_PATH)
+
+def _migrate_legacy_file() -> List[dict]:
+    """Migrar el antiguo data/studies.json (lista JSON) al log JSONL"""
+    try:
+        with open(LEGACY_DATA_PATH, 'rb') as f:
+            studies = orjson.loads(f.read())
+    except Exception as e:
+        logger.error(f"Error migrando {LEGACY_DATA_PATH}: {e}")
+        return []
+    _write_log_atomic(studies)
+    return studies
+
+def _read_log() -> List[dict]:
     if not os.path.exists(DATA_PATH):
+        if os.path.exists(LEGACY_DATA_PATH):
+            return _migrate_legacy_file()
         return []
-    with open(DATA_PATH, 'r') as f:
-        try:
-            return json.load(f)
-        except Exception:
-            return []
+    records = []
+    with open(DATA_PATH, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                records.append(orjson.loads(line))
+            except Exception as e:
+                # Línea rota (p.ej. append interrumpido por un crash): se
+                # salta y el resto del log sigue siendo válido
+                logger.warning(f"Línea inválida en {DATA_PATH}, ignorada: {e}")
+    return records
 
-def save_studies(studies: List[dict]):
-    with open(DATA_PATH, 'w') as f:
-        json.dump(studies, f, indent=2, ensure_ascii=False)
+def _fold_log(records: List[dict]) -> List[dict]:
+    """Plegar el log de operaciones al estado actual de los estudios"""
+    studies = {}
+    for record in records:
+        op = record.get('_op')
+        if op == 'del':
+            studies.pop(record['id'], None)
+        elif op == 'patch':
+            study = studies.get(record['id'])
+            if study is not None:
+                study.update({k: v for k, v in record.items() if k != '_op'})
+        else:
+            studies[record['id']] = record
+    return list(studies.values())
+
+def _compact(studies: List[dict]):
+    """Reescribir el log solo con los estudios vivos"""
+    _write_log_atomic(studies)
+
+def _append_log_sync(data: bytes):
+    with open(DATA_PATH, 'ab') as f:
+        f.write(data)
+
+async def append_study_op(record: dict):
+    """Apendizar una operación (alta/patch/delete) al log sin bloquear el loop"""
+    global _mtime_ns
+    await asyncio.to_thread(_append_log_sync, orjson.dumps(record) + b'\n')
+    # El cache ya refleja la operación: registrar el nuevo mtime para
+    # no replegar el log en la siguiente lectura
+    try:
+        _mtime_ns = os.stat(DATA_PATH).st_mtime_ns
+    except OSError:
+        pass
+
+async def load_studies() -> List[dict]:
+    global _cache, _mtime_ns
+    async with _lock:
+        try:
+            mtime_ns = os.stat(DATA_PATH).st_mtime_ns
+        except OSError:
+            mtime_ns = 0
+        if _cache is None or mtime_ns != _mtime_ns:
+            records = await asyncio.to_thread(_read_log)
+            _cache = _fold_log(records)
+            # Índice secundario para el filtro por paciente de GET /studies
+            _by_patient.clear()
+            for study in _cache:
+                _by_patient.setdefault(study['patient_id'], []).append(study)
+            if len(records) - len(_cache) >= COMPACT_SLACK:
+                await asyncio.to_thread(_compact, _cache)
+            try:
+                _mtime_ns = os.stat(DATA_PATH).st_mtime_ns
+            except OSError:
+                _mtime_ns = 0
+        return _cache
 
 @router.get("/studies", response_model=List[Study], summary="Listar estudios")
 async def get_studies(patient_id: Optional[str] = None):
-    studies = load_studies()
+    studies = await load_studies()
     if patient_id:
-        studies = [s for s in studies if s['patient_id'] == patient_id]
+        return list(_by_patient.get(patient_id, []))
     return studies
 
 @router.post("/studies", response_model=Study, summary="Crear estudio y subir imagen")
 async def create_study(
+    request: Request,
     patient_id: str = Form(...),
     descripcion: str = Form(None),
     file: UploadFile = File(...)
 ):
-    print("[DEBUG] POST /studies llamado")
-    print(f"[DEBUG] patient_id: {patient_id}")
-    print(f"[DEBUG] descripcion: {descripcion}")
-    print(f"[DEBUG] file.filename: {file.filename}")
-    print(f"[DEBUG] file.file type: {type(file.file)}")
-    try:
-        file.file.seek(0, 2)
-        size = file.file.tell()
-        file.file.seek(0)
-        print(f"[DEBUG] file actual size: {size} bytes")
-    except Exception as e:
-        print(f"[ERROR] No se pudo determinar el tamaño del archivo: {e}")
-    studies = load_studies()
+    logger.debug(f"POST /studies: patient_id={patient_id} filename={file.filename}")
+    settings = get_settings()
+
+    # Rechazar antes de tocar disco: extensión no permitida o cuerpo
+    # declarado mayor que el límite no cuestan ni un solo write
+    extension = os.path.splitext(file.filename or '')[1].lower().lstrip('.')
+    if extension not in settings.allowed_extension_set:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Extensión no permitida: {extension or '(sin extensión)'}"
+        )
+    content_length = request.headers.get('content-length')
+    if content_length and int(content_length) > settings.max_file_size + 4096:
+        # Margen para los headers del multipart
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Archivo demasiado grande"
+        )
+
     study_id = str(uuid.uuid4())
     fecha_estudio = datetime.now().isoformat()
-    # Crear carpetas si no existen
-    if not os.path.exists(IMAGES_PATH):
-        os.makedirs(IMAGES_PATH)
-    if not os.path.exists(REPORTS_PATH):
-        os.makedirs(REPORTS_PATH)
-    filename = f"{study_id}_{file.filename}"
+    filename = f"{study_id}_{_FILENAME_SAFE_RE.sub('_', file.filename)}"
     file_path = os.path.join(IMAGES_PATH, filename)
-    print(f"[DEBUG] Guardando archivo en: {file_path}")
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        print(f"[DEBUG] Archivo guardado correctamente")
+        # Copia asíncrona en chunks: no bloquea el event loop y el RSS
+        # no crece con el tamaño del archivo
+        written = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > settings.max_file_size:
+                    # El content-length mintió (o faltaba): cortar aquí
+                    await buffer.close()
+                    os.remove(file_path)
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Archivo demasiado grande"
+                    )
+                await buffer.write(chunk)
+        logger.debug(f"Archivo guardado en: {file_path}")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Error guardando archivo: {e}")
+        logger.error(f"Error guardando archivo: {e}")
     try:
         study = Study(
             id=study_id,
@@ -88,12 +230,14 @@ async def create_study(
             filename=filename,  # Solo el nombre, no la ruta completa
             descripcion=descripcion
         )
-        studies.append(study.dict())
-        save_studies(studies)
-        print(f"[DEBUG] Estudio guardado en studies.json: {study.dict()}")
+        record = study.dict()
+        (await load_studies()).append(record)
+        _by_patient.setdefault(record['patient_id'], []).append(record)
+        await append_study_op(record)
+        logger.debug(f"Estudio apendizado en studies.jsonl: {study_id}")
         return study
     except Exception as e:
-        print(f"[ERROR] Error guardando estudio en JSON: {e}")
+        logger.error(f"Error guardando estudio en JSON: {e}")
         raise HTTPException(status_code=500, detail=f"Error guardando estudio: {e}")
 
 @router.patch("/studies/{study_id}", response_model=Study, summary="Actualizar diagnóstico/confianza de un estudio")
@@ -102,22 +246,172 @@ async def update_study(
     diagnostico: str = Form(None),
     confianza: float = Form(None)
 ):
-    studies = load_studies()
+    studies = await load_studies()
     for study in studies:
         if study["id"] == study_id:
+            patch = {"id": study_id, "_op": "patch"}
             if diagnostico is not None:
                 study["diagnostico"] = diagnostico
+                patch["diagnostico"] = diagnostico
             if confianza is not None:
                 study["confianza"] = confianza
-            save_studies(studies)
+                patch["confianza"] = confianza
+            await append_study_op(patch)
             return study
     raise HTTPException(status_code=404, detail="Estudio no encontrado")
 
 @router.delete("/studies/{study_id}", summary="Borrar un estudio")
 async def delete_study(study_id: str = Path(..., description="ID del estudio a borrar")):
-    studies = load_studies()
-    new_studies = [s for s in studies if s["id"] != study_id]
-    if len(new_studies) == len(studies):
-        raise HTTPException(status_code=404, detail="Estudio no encontrado")
-    save_studies(new_studies)
-    return {"success": True, "deleted_id": study_id} 
\ No newline at end of file
+    studies = await load_studies()
+    for i, study in enumerate(studies):
+        if study["id"] == study_id:
+            studies.pop(i)
+            patient_studies = _by_patient.get(study['patient_id'])
+            if patient_studies is not None and study in patient_studies:
+                patient_studies.remove(study)
+            await append_study_op({"id": study_id, "_op": "del"})
+            return {"success": True, "deleted_id": study_id}
+    raise HTTPException(status_code=404, detail="Estudio no encontrado")
+
+# --- Subida multipart -------------------------------------------------------
+# Para volúmenes DICOM grandes un único POST obliga a reempezar desde el
+# byte 0 ante cualquier corte. El protocolo en tres pasos permite subir
+# partes en paralelo y reintentar solo la parte fallida:
+#   POST /studies/upload/begin                  -> {upload_id, part_size}
+#   PUT  /studies/upload/{upload_id}/{part_idx} -> guarda la parte
+#   POST /studies/upload/{upload_id}/complete   -> concatena y crea el estudio
+
+def _upload_dir(upload_id: str) -> str:
+    # El upload_id lo genera el servidor (uuid4); validarlo igualmente
+    # para que nadie inyecte rutas en el path
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subida no encontrada")
+    return os.path.join(PARTS_PATH, upload_id)
+
+def _remove_upload_dir(upload_dir: str):
+    """Borrar las partes y metadatos de una subida descartada"""
+    for name in os.listdir(upload_dir):
+        os.remove(os.path.join(upload_dir, name))
+    os.rmdir(upload_dir)
+
+def _concat_parts_sync(part_paths: List[str], dst_path: str):
+    """Concatenar las partes en el destino con os.sendfile (copia en kernel)"""
+    with open(dst_path, 'wb') as dst:
+        for part_path in part_paths:
+            with open(part_path, 'rb') as src:
+                size = os.fstat(src.fileno()).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+
+@router.post("/studies/upload/begin", summary="Iniciar subida multipart")
+async def begin_upload(
+    patient_id: str = Form(...),
+    filename: str = Form(...),
+    descripcion: str = Form(None)
+):
+    settings = get_settings()
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension not in settings.allowed_extension_set:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Extensión no permitida: {extension or '(sin extensión)'}"
+        )
+    upload_id = str(uuid.uuid4())
+    upload_dir = os.path.join(PARTS_PATH, upload_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    meta = {
+        "patient_id": patient_id,
+        "filename": _FILENAME_SAFE_RE.sub('_', filename),
+        "descripcion": descripcion,
+    }
+    async with aiofiles.open(os.path.join(upload_dir, 'meta.json'), 'wb') as f:
+        await f.write(orjson.dumps(meta))
+    return {"upload_id": upload_id, "part_size": UPLOAD_PART_SIZE}
+
+@router.put("/studies/upload/{upload_id}/{part_idx}", summary="Subir una parte")
+async def upload_part(
+    request: Request,
+    upload_id: str = Path(..., description="ID de la subida"),
+    part_idx: int = Path(..., ge=0, description="Índice de la parte (desde 0)")
+):
+    upload_dir = _upload_dir(upload_id)
+    if not os.path.isdir(upload_dir):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subida no encontrada")
+    part_path = os.path.join(upload_dir, f"{part_idx}.bin")
+    written = 0
+    # Streaming directo del cuerpo a disco: la parte nunca se buffea entera
+    async with aiofiles.open(part_path, 'wb') as f:
+        async for chunk in request.stream():
+            written += len(chunk)
+            if written > UPLOAD_PART_SIZE:
+                await f.close()
+                os.remove(part_path)
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Parte mayor que part_size ({UPLOAD_PART_SIZE} bytes)"
+                )
+            await f.write(chunk)
+    return {"upload_id": upload_id, "part_idx": part_idx, "size": written}
+
+@router.post("/studies/upload/{upload_id}/complete", response_model=Study, summary="Completar subida multipart")
+async def complete_upload(upload_id: str = Path(..., description="ID de la subida")):
+    upload_dir = _upload_dir(upload_id)
+    meta_path = os.path.join(upload_dir, 'meta.json')
+    if not os.path.isfile(meta_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subida no encontrada")
+    async with aiofiles.open(meta_path, 'rb') as f:
+        meta = orjson.loads(await f.read())
+
+    part_files = [name for name in os.listdir(upload_dir) if name.endswith('.bin')]
+    if not part_files:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="La subida no tiene partes")
+    indices = sorted(int(name[:-4]) for name in part_files)
+    if indices != list(range(len(indices))):
+        missing = sorted(set(range(indices[-1] + 1)) - set(indices))
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Faltan partes: {missing}"
+        )
+    part_paths = [os.path.join(upload_dir, f"{idx}.bin") for idx in indices]
+
+    settings = get_settings()
+    total_size = sum(os.path.getsize(p) for p in part_paths)
+    if total_size > settings.max_file_size:
+        # Descartar las partes: nada las reaprovecharía y quedarían
+        # ocupando hasta max_file_size de disco por intento
+        _remove_upload_dir(upload_dir)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Archivo demasiado grande"
+        )
+
+    study_id = str(uuid.uuid4())
+    filename = f"{study_id}_{meta['filename']}"
+    file_path = os.path.join(IMAGES_PATH, filename)
+    await asyncio.to_thread(_concat_parts_sync, part_paths, file_path)
+
+    # Limpiar las partes ya concatenadas
+    for part_path in part_paths:
+        os.remove(part_path)
+    os.remove(meta_path)
+    os.rmdir(upload_dir)
+
+    study = Study(
+        id=study_id,
+        patient_id=meta['patient_id'],
+        fecha_estudio=datetime.now().isoformat(),
+        filename=filename,
+        descripcion=meta.get('descripcion')
+    )
+    record = study.dict()
+    (await load_studies()).append(record)
+    _by_patient.setdefault(record['patient_id'], []).append(record)
+    await append_study_op(record)
+    logger.debug(f"Subida multipart completada: {upload_id} -> {study_id} ({total_size} bytes)")
+    return study
@@ -4,8 +4,9 @@ Gestión de configuración usando Pydantic Settings
 """
 
 from pydantic_settings import BaseSettings
-from pydantic import Field, field_validator
-from typing import List, Optional
+from pydantic import Field, PrivateAttr, field_validator
+from typing import List, Optional, Tuple
+from functools import cached_property, lru_cache
 import os
 import json
 
@@ -48,11 +49,11 @@ class Settings(BaseSettings):
         default=10485760,  # 10MB
         description="Tamaño máximo de archivo en bytes"
     )
-    allowed_extensions: List[str] = Field(
-        default=["jpg", "jpeg", "png", "dicom", "dcm"],
+    allowed_extensions: Tuple[str, ...] = Field(
+        default=("jpg", "jpeg", "png", "dicom", "dcm"),
         description="Extensiones de archivo permitidas"
     )
-    
+
     @field_validator('allowed_extensions', mode='before')
     @classmethod
     def parse_allowed_extensions(cls, v):
@@ -69,8 +70,8 @@ class Settings(BaseSettings):
     
     # Configuración de seguridad
     secret_key: str = Field(..., description="Clave secreta para JWT", env="SECRET_KEY")
-    cors_origins: List[str] = Field(
-        default=["http://localhost:8080", "http://127.0.0.1:8080"],
+    cors_origins: Tuple[str, ...] = Field(
+        default=("http://localhost:8080", "http://127.0.0.1:8080"),
         description="Orígenes permitidos para CORS"
     )
     
@@ -88,6 +89,10 @@ class Settings(BaseSettings):
     max_workers: int = Field(default=4, description="Máximo número de workers")
     batch_size: int = Field(default=1, description="Tamaño de lote para inferencia")
     gpu_enabled: bool = Field(default=False, description="Habilitar GPU")
+    int8_inference: bool = Field(
+        default=True,
+        description="Usar pesos INT8 cuantizados en inferencia CPU (FP32 si False)"
+    )
     
     class Config:
         """Configuración de Pydantic"""
@@ -105,31 +110,61 @@ class Settings(BaseSettings):
         """Verifica si está en modo producción"""
         return not self.debug and self.log_level == "INFO"
     
+    # Flag de idempotencia: las rutas solo se comprueban una vez por proceso
+    _paths_validated: bool = PrivateAttr(default=False)
+
     def validate_paths(self) -> bool:
-        """Valida que las rutas necesarias existan"""
+        """Valida que las rutas necesarias existan (solo la primera vez)"""
+        if self._paths_validated:
+            return True
+
         paths_to_check = [
             self.model_path,
             self.upload_path
         ]
-        
+
         for path in paths_to_check:
             if not os.path.exists(path):
                 os.makedirs(path, exist_ok=True)
-        
+
+        self._paths_validated = True
         return True
     
+    _MIME_MAPPING = {
+        "jpg": "image/jpeg",
+        "jpeg": "image/jpeg",
+        "png": "image/png",
+        "dicom": "application/dicom",
+        "dcm": "application/dicom"
+    }
+
+    @cached_property
+    def allowed_extension_set(self) -> frozenset:
+        """Extensiones permitidas como frozenset para chequeos O(1) en uploads"""
+        return frozenset(ext.lower() for ext in self.allowed_extensions)
+
+    @cached_property
+    def allowed_mime_type_set(self) -> frozenset:
+        """Tipos MIME permitidos como frozenset (membership O(1))"""
+        return frozenset(self.allowed_mime_types)
+
+    @cached_property
+    def allowed_mime_types(self) -> Tuple[str, ...]:
+        """Tipos MIME permitidos (se construye una sola vez por instancia)"""
+        return tuple(self._MIME_MAPPING.get(ext, "application/octet-stream")
+                     for ext in self.allowed_extensions)
+
     def get_allowed_mime_types(self) -> List[str]:
         """Obtiene los tipos MIME permitidos"""
-        mime_mapping = {
-            "jpg": "image/jpeg",
-            "jpeg": "image/jpeg", 
-            "png": "image/png",
-            "dicom": "application/dicom",
-            "dcm": "application/dicom"
-        }
-        
-        return [mime_mapping.get(ext, "application/octet-stream") 
-                for ext in self.allowed_extensions]
+        return list(self.allowed_mime_types)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Instancia única de configuración
 
-# Instancia global de configuración
-settings = Settings() 
\ No newline at end of file
+    El parseo del .env y la validación de Pydantic se pagan una sola vez
+    por proceso; los consumidores llaman a get_settings() en lugar de
+    instanciar Settings() o importar un global creado en el import.
+    """
+    return Settings()
\ No newline at end of file
@@ -3,29 +3,27 @@ Dependencias de la API RADOX
 Funciones de dependencia para inyección de servicios
 """
 
-from fastapi import HTTPException
+from fastapi import FastAPI, HTTPException, Request
 
-# Variables globales para servicios (se inicializan en main.py)
-# Estas variables se asignan desde main.py durante la inicialización
-cnn_model = None
-detection_service = None
-report_service = None
+# Los servicios viven en app.state (se registran en el lifespan de main.py);
+# los providers los resuelven desde la Request sin pasar por globals de módulo
 
-def set_services(cnn_model_instance, detection_service_instance, report_service_instance):
-    """Establecer las instancias de servicios (llamado desde main.py)"""
-    global cnn_model, detection_service, report_service
-    cnn_model = cnn_model_instance
-    detection_service = detection_service_instance
-    report_service = report_service_instance
+def set_services(app: FastAPI, cnn_model_instance, detection_service_instance, report_service_instance):
+    """Registrar las instancias de servicios en app.state (llamado desde main.py)"""
+    app.state.cnn_model = cnn_model_instance
+    app.state.detection_service = detection_service_instance
+    app.state.report_service = report_service_instance
 
-def get_detection_service():
+def get_detection_service(request: Request):
     """Obtener servicio de detección de neumonía"""
-    if detection_service is None:
+    service = getattr(request.app.state, 'detection_service', None)
+    if service is None:
         raise HTTPException(status_code=503, detail="Servicio de detección no disponible")
-    return detection_service
+    return service
 
-def get_report_service():
+def get_report_service(request: Request):
     """Obtener servicio de generación de informes"""
-    if report_service is None:
+    service = getattr(request.app.state, 'report_service', None)
+    if service is None:
         raise HTTPException(status_code=503, detail="Servicio de informes no disponible")
-    return report_service 
\ No newline at end of file
+    return service
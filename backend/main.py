@@ -3,17 +3,21 @@ RADOX - Sistema de Detección de Neumonía con IA
 Archivo principal de la API FastAPI
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+import pathlib
+import time
 import logging
 from loguru import logger
 
-from backend.config.settings import Settings
+from backend.config.settings import get_settings
+from backend.utils.orjson_response import ORJSONResponse
 from backend.api.routes import pneumonia, reports, patients, studies
 from backend.models.cnn_model import CNNModel
 from backend.services.pneumonia_detection import PneumoniaDetectionService
@@ -33,9 +37,26 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Iniciando RADOX API...")
     
     try:
-        # Inicializar configuración
-        settings = Settings()
+        # Inicializar configuración (instancia única cacheada)
+        settings = get_settings()
+        settings.validate_paths()
         
+        # Repartir los cores entre workers antes de cargar el modelo:
+        # sin esto Torch reclama todos los cores en cada worker y los
+        # context switches se comen el throughput bajo carga.
+        # (OMP_NUM_THREADS ya no serviría aquí: torch se importa al cargar
+        # el módulo y OpenMP lee el entorno en ese momento; el reparto
+        # efectivo lo hace set_num_threads)
+        import torch
+        threads = max(1, (os.cpu_count() or 1) // settings.max_workers)
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Ya hubo trabajo paralelo (p.ej. reload de uvicorn); ignorar
+            pass
+        logger.info(f"🧵 Torch: {threads} threads intra-op, 1 inter-op")
+
         # Inicializar modelos
         logger.info("📦 Cargando modelo CNN...")
         cnn_model_instance = CNNModel(settings.model_path)
@@ -46,13 +67,19 @@ async def lifespan(app: FastAPI):
         detection_service_instance = PneumoniaDetectionService(cnn_model_instance)
         report_service_instance = ReportGenerationService(settings.huggingface_token, settings.medgemma_model)
         
-        # Establecer servicios en dependencies
-        set_services(cnn_model_instance, detection_service_instance, report_service_instance)
+        # Registrar servicios en app.state
+        set_services(app, cnn_model_instance, detection_service_instance, report_service_instance)
         
         logger.success("✅ RADOX API iniciada correctamente")
-        
+
         yield
-        
+
+        # Invalidar el cache de /health al apagar
+        global _health_cache
+        _health_cache = (0.0, None)
+
+        await report_service_instance.close()
+
     except Exception as e:
         logger.error(f"❌ Error al inicializar RADOX API: {e}")
         raise
@@ -66,6 +93,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -83,12 +111,15 @@ app.add_middleware(
 
 # Middleware de seguridad
 app.add_middleware(
-    TrustedHostMiddleware, 
+    TrustedHostMiddleware,
     allowed_hosts=["*"]  # Permitir todos los hosts en desarrollo
 )
 
+# Compresión de respuestas JSON grandes
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
 # Montar archivos estáticos
-PROJECT_ROOT = '/home/mbrq/Documents/RADOX'
+PROJECT_ROOT = str(pathlib.Path(__file__).resolve().parents[1])
 os.makedirs(os.path.join(PROJECT_ROOT, "data/uploads"), exist_ok=True)
 os.makedirs(os.path.join(PROJECT_ROOT, "data/uploads/images"), exist_ok=True)
 os.makedirs(os.path.join(PROJECT_ROOT, "data/uploads/reports"), exist_ok=True)
@@ -115,18 +146,31 @@ async def root():
         "docs": "/docs"
     }
 
+# Cache TTL del health check: los load balancers lo golpean cada segundo
+# por pod y no hace falta recomputar el estado en cada probe
+_HEALTH_TTL_S = 2.0
+_health_cache = (0.0, None)
+
 @app.get("/health")
-async def health_check():
-    """Verificación de salud del sistema"""
+async def health_check(request: Request):
+    """Verificación de salud del sistema (cacheada unos segundos)"""
+    global _health_cache
+    cached_at, cached_status = _health_cache
+    if cached_status is not None and time.monotonic() - cached_at < _HEALTH_TTL_S:
+        return cached_status
     try:
-        from backend.dependencies import cnn_model, detection_service, report_service
-        
+        state = request.app.state
+        cnn_model = getattr(state, 'cnn_model', None)
+        detection_service = getattr(state, 'detection_service', None)
+        report_service = getattr(state, 'report_service', None)
+
         health_status = {
             "status": "healthy",
             "services": {
                 "api": "running",
                 "cnn_model": "loaded" if cnn_model and cnn_model.is_loaded else "not_loaded",
                 "detection_service": "available" if detection_service else "unavailable",
+                "prediction_cache_entries": detection_service.prediction_cache_size if detection_service else 0,
                 "report_service": "available" if report_service else "unavailable"
             }
         }
@@ -140,7 +184,8 @@ async def health_check():
         
         if not all_healthy:
             health_status["status"] = "degraded"
-        
+
+        _health_cache = (time.monotonic(), health_status)
         return health_status
         
     except Exception as e:
@@ -169,11 +214,13 @@ async def api_info():
 
 if __name__ == "__main__":
     # Configuración para desarrollo
-    settings = Settings()
+    settings = get_settings()
     uvicorn.run(
         "backend.main:app",
         host="0.0.0.0",
         port=8000,
         reload=True,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     ) 
\ No newline at end of file
@@ -13,11 +13,11 @@ import os
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
 import tensorflow as tf
-tf.config.optimizer.set_jit(False)
-tf.config.run_functions_eagerly(True)
 
+import base64
 import json
 import logging
+import cv2
 import h5py
 import numpy as np
 from tensorflow import keras
@@ -35,6 +35,40 @@ class CNNModel:
         self.input_shape = (150, 150, 3)
         # Nota: asumimos index 0 = Normal, 1 = Neumonía
         self.class_names = ["Normal", "Neumonía"]
+        # Forward compilado con XLA (shape fija -> fusión de kernels)
+        self._predict_fn = None
+        # Sub-modelo Grad-CAM construido una sola vez tras load_model
+        self._grad_model = None
+
+    def _build_grad_model(self):
+        """Localiza la última capa conv y cachea el sub-modelo Grad-CAM;
+        reconstruirlo por petición pagaba el ensamblado del grafo Keras
+        y el escaneo O(capas) cada vez."""
+        last_conv_name = None
+        for layer in reversed(self.model.layers):
+            if len(layer.output_shape) == 4:
+                last_conv_name = layer.name
+                break
+        if last_conv_name is None:
+            return
+        self._grad_model = keras.models.Model(
+            inputs=self.model.inputs,
+            outputs=[
+                self.model.get_layer(last_conv_name).output,
+                self.model.output
+            ]
+        )
+
+    def _build_predict_fn(self):
+        """Compila el forward con XLA y lo pre-tracea con un tensor dummy
+        para que la compilación ocurra en el arranque, no en la primera
+        petición."""
+        self._predict_fn = tf.function(
+            lambda x: self.model(x, training=False),
+            jit_compile=True,
+            input_signature=[tf.TensorSpec([1, *self.input_shape], tf.float32)],
+        )
+        self._predict_fn(tf.zeros([1, *self.input_shape], tf.float32))
 
     async def load_model(self) -> bool:
         """Carga tu model.h5 (o reconstruye desde model_config)."""
@@ -42,6 +76,8 @@ class CNNModel:
             logger.info(f"Cargando modelo con keras.models.load_model: {self.model_path}")
             self.model = keras.models.load_model(self.model_path)
             self.input_shape = tuple(self.model.input_shape[1:])
+            self._build_predict_fn()
+            self._build_grad_model()
             self.is_loaded = True
             logger.info(f"✅ Modelo cargado. Input shape = {self.input_shape}")
             return True
@@ -59,6 +95,8 @@ class CNNModel:
             self.model = keras.models.model_from_config(config['config'])
             self.model.load_weights(self.model_path)
             self.input_shape = tuple(self.model.input_shape[1:])
+            self._build_predict_fn()
+            self._build_grad_model()
             self.is_loaded = True
             logger.info(f"✅ Arquitectura restaurada. Input shape = {self.input_shape}")
             return True
@@ -71,8 +109,11 @@ class CNNModel:
         if image_array.ndim == 2:
             image_array = np.stack([image_array]*3, axis=-1)
         h, w, _ = self.input_shape
-        img = tf.image.resize(image_array, [h, w]).numpy()
-        img = img.astype('float32') / 255.0
+        # cv2.resize usa SIMD directamente, sin el round-trip por un
+        # tensor TF en modo eager; la normalización se hace in-place
+        img = cv2.resize(image_array, (w, h), interpolation=cv2.INTER_AREA)
+        img = img.astype(np.float32, copy=False)
+        img *= 1.0 / 255.0
         return np.expand_dims(img, axis=0)
 
     async def predict(self, image_array: np.ndarray) -> dict:
@@ -89,7 +130,10 @@ class CNNModel:
 
         # Forzar CPU
         with tf.device('/CPU:0'):
-            raw_preds = self.model.predict(batch, verbose=0)
+            if self._predict_fn is not None:
+                raw_preds = self._predict_fn(tf.constant(batch)).numpy()
+            else:
+                raw_preds = self.model.predict(batch, verbose=0)
 
         preds = np.array(raw_preds).reshape(-1).astype(float)
         # Guarda salida cruda
@@ -119,34 +163,28 @@ class CNNModel:
             prob_neumonia = float(preds[1])
             grad_index = idx
 
-        # Grad‑CAM
+        # Grad‑CAM: se devuelve como PNG base64 en lugar de una lista de
+        # floats Python (miles de boxings + expansión JSON por respuesta)
         heatmap = self._make_gradcam_heatmap(batch, grad_index)
+        heatmap_resized = cv2.resize(heatmap, (224, 224))
+        heatmap_u8 = (heatmap_resized * 255).astype(np.uint8)
+        _, heatmap_png = cv2.imencode('.png', heatmap_u8)
 
         return {
             "predicted_class": self.class_names[idx],
             "confidence": confidence,
             "class_probabilities": class_probs,
-            "heatmap": heatmap.tolist(),
+            "heatmap_png_b64": base64.b64encode(heatmap_png).decode('ascii'),
             "raw_predictions": raw_list,
             "has_pneumonia": has_pneumonia,
             "prob_neumonia": prob_neumonia
         }
 
     def _make_gradcam_heatmap(self, img_array: np.ndarray, class_index: int) -> np.ndarray:
-        """Grad‑CAM sobre la última capa conv."""
-        last_conv_name = None
-        for layer in reversed(self.model.layers):
-            if len(layer.output_shape) == 4:
-                last_conv_name = layer.name
-                break
-
-        grad_model = keras.models.Model(
-            inputs=self.model.inputs,
-            outputs=[
-                self.model.get_layer(last_conv_name).output,
-                self.model.output
-            ]
-        )
+        """Grad‑CAM sobre la última capa conv (sub-modelo cacheado)."""
+        if self._grad_model is None:
+            self._build_grad_model()
+        grad_model = self._grad_model
 
         with tf.GradientTape() as tape:
             conv_out, predictions = grad_model(img_array)
@@ -156,11 +194,11 @@ class CNNModel:
         pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2)).numpy()
         conv_values = conv_out.numpy()[0]
 
-        for i in range(pooled_grads.shape[-1]):
-            conv_values[:, :, i] *= pooled_grads[i]
-
-        heatmap = np.mean(conv_values, axis=-1)
-        heatmap = np.maximum(heatmap, 0)
+        # Contracción vectorizada sobre canales en lugar del bucle Python
+        # por canal (cientos de iteraciones) + una materialización menos
+        heatmap = np.einsum('hwc,c->hw', conv_values, pooled_grads)
+        heatmap /= conv_values.shape[-1]
+        np.maximum(heatmap, 0, out=heatmap)
         heatmap /= (np.max(heatmap) + 1e-8)
         return heatmap
 
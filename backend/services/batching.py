@@ -0,0 +1,83 @@
+"""
+Micro-batching Asíncrono para Inferencia
+Agrupa peticiones concurrentes en lotes para amortizar el forward del modelo
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from loguru import logger
+
+# Configurables por entorno para ajustar throughput vs latencia
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "16"))
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "10"))
+
+class Batcher:
+    """Cola compartida que agrupa peticiones concurrentes en lotes"""
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = MAX_BATCH_SIZE,
+        window_ms: int = BATCH_WINDOW_MS
+    ):
+        """
+        Inicializar el batcher
+
+        Args:
+            process_batch: Corrutina que procesa una lista de items y
+                devuelve una lista de resultados en el mismo orden
+            max_batch: Tamaño máximo de lote
+            window_ms: Ventana de espera para acumular peticiones (ms)
+        """
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Encolar un item y esperar su resultado
+
+        Args:
+            item: Entrada individual para el lote
+
+        Returns:
+            Resultado correspondiente al item
+        """
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._loop())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _loop(self):
+        """Drenar la cola en lotes y despachar al procesador"""
+        while True:
+            batch: List[Tuple[Any, asyncio.Future]] = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.window
+
+            # Acumular hasta max_batch o hasta agotar la ventana
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await self.process_batch(items)
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                logger.error(f"Error procesando lote de {len(batch)} items: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
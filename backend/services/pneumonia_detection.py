@@ -3,46 +3,246 @@ Servicio de Detección de Neumonía
 Lógica de negocio para la detección de neumonía usando CNN
 """
 
+import io
 import os
+import hashlib
 import uuid
 import numpy as np
 from typing import Dict, Any, Optional
+from collections import OrderedDict
 from datetime import datetime
 from loguru import logger
 import cv2
-from PIL import Image
 import pydicom
 import asyncio
+import aiohttp
+import orjson
+
+from concurrent.futures import ThreadPoolExecutor
 
 from backend.models.cnn_model import CNNModel
+from backend.services.batching import Batcher
+
+# Executor compartido para el trabajo CPU-bound del servicio (decode de
+# imágenes, parse DICOM, Grad-CAM): OpenCV/pydicom/Torch sueltan el GIL
+# en sus kernels nativos, así las subidas concurrentes se procesan en
+# paralelo sin bloquear el event loop
+_CPU_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Decoder JPEG de libjpeg-turbo (opcional): IDCT y conversión de color
+# SIMD, típicamente 2-4x más rápido que el decode JPEG de OpenCV.
+# PNG (y cualquier fallo) siguen por cv2.imdecode
+try:
+    from turbojpeg import TurboJPEG, TJPF_GRAY
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    _turbo_jpeg = None
+
+# Máximo de predicciones cacheadas por hash de imagen
+_PREDICTION_CACHE_MAX = 256
+
+# Límite de inferencias (forward + Grad-CAM) en vuelo: con más peticiones
+# simultáneas que ~la mitad de los cores, los forwards compiten por CPU y
+# la latencia p99 se dispara sin ganar throughput; el resto espera aquí
+_INFER_SEM = asyncio.Semaphore(
+    int(os.getenv("RADOX_INFER_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2))))
+)
+
+# Lado de la entrada del modelo (DenseNet121 de torchxrayvision)
+_MODEL_INPUT_SIZE = 224
+
+# Por debajo de este tamaño el overhead de lanzar el kernel JIT supera
+# a la ruta NumPy
+_WINDOW_NUMBA_MIN_PIXELS = 256_000
+
+# Diagnóstico y severidad por banda de confianza (umbral 0.7/0.8/0.9):
+# banda = nº de umbrales superados; tablas precomputadas en lugar de la
+# cadena de if/elif por caso
+_CONF_THRESHOLDS = (0.7, 0.8, 0.9)
+_DIAGNOSIS_TABLE = {0: "Neumonía posible", 1: "Neumonía", 2: "Neumonía", 3: "Neumonía probable"}
+_SEVERITY_TABLE = {0: "leve", 1: "leve", 2: "moderada", 3: "alta"}
+
+# Hallazgos por (severidad, confianza < 0.8): los textos solo dependen de
+# esas dos variables, así que las frases se ensamblan una vez al importar
+# el módulo y cada caso es un lookup O(1) sin listas ni joins
+_FINDINGS_ITEMS = {
+    "alta": (
+        "Consolidación pulmonar evidente",
+        "Broncograma aéreo visible",
+        "Opacidades densas con límites definidos",
+        "Probable derrame pleural asociado",
+    ),
+    "moderada": (
+        "Infiltrados pulmonares parcheados",
+        "Opacidades de densidad intermedia",
+        "Patrón alveolar focal",
+        "Engrosamiento intersticial",
+    ),
+    "leve": (
+        "Opacidades sutiles en vidrio esmerilado",
+        "Infiltrados intersticiales mínimos",
+        "Cambios inflamatorios incipientes",
+        "Patrón reticular fino",
+    ),
+}
+_FINDINGS = {
+    (sev, uncertain): ". ".join(
+        items + (("Hallazgos requieren correlación clínica",) if uncertain else ())
+    ) + "."
+    for sev, items in _FINDINGS_ITEMS.items()
+    for uncertain in (False, True)
+}
+_FINDINGS_NORMAL = "Campos pulmonares limpios, sin signos de consolidación o infiltrados"
+
+# Kernel de ventana compilado con numba (opcional): para slices grandes
+# (CR/CT de 2-4k px) fusiona clip + escala + cast uint8 en un solo bucle
+# paralelo autovectorizado, sin los temporales de la cadena NumPy
+try:
+    from numba import njit, prange
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _window_to_uint8_numba(arr, lo, width):
+        h, w = arr.shape
+        out = np.empty((h, w), dtype=np.uint8)
+        scale = 255.0 / width
+        for i in prange(h):
+            for j in range(w):
+                v = arr[i, j] - lo
+                if v < 0.0:
+                    v = 0.0
+                elif v > width:
+                    v = width
+                out[i, j] = np.uint8(v * scale + 0.5)
+        return out
+
+    # Pre-compilar con un dummy minúsculo: el coste del JIT se paga al
+    # importar el módulo, no en la primera petición real
+    _window_to_uint8_numba(np.zeros((2, 2), dtype=np.float32), 0.0, 1.0)
+except Exception:
+    _window_to_uint8_numba = None
 
 class PneumoniaDetectionService:
     """Servicio para la detección de neumonía en radiografías"""
-    
+
+    # (clave de salida, tag DICOM, valor por defecto): la metadata se
+    # extrae en una pasada directa por tags numéricos, sin la traducción
+    # keyword->tag y la maquinaria de atributos que paga cada getattr
+    _METADATA_TAGS = (
+        ("patient_id",      0x00100020, ''),
+        ("patient_name",    0x00100010, ''),
+        ("patient_age",     0x00101010, ''),
+        ("patient_sex",     0x00100040, ''),
+        ("study_date",      0x00080020, ''),
+        ("study_time",      0x00080030, ''),
+        ("modality",        0x00080060, ''),
+        ("institution",     0x00080080, ''),
+        ("manufacturer",    0x00080070, ''),
+        ("model",           0x00081090, ''),
+        ("body_part",       0x00180015, ''),
+        ("view_position",   0x00185101, ''),
+        ("pixel_spacing",   0x00280030, []),
+        ("slice_thickness", 0x00180050, ''),
+        ("kvp",             0x00180060, ''),
+        ("exposure_time",   0x00181150, ''),
+        ("window_center",   0x00281050, ''),
+        ("window_width",    0x00281051, ''),
+    )
+
+    # Rows y Columns para image_size, incluidos en el parse selectivo
+    _SPECIFIC_TAGS = [t for _, t, _ in _METADATA_TAGS] + [0x00280010, 0x00280011]
+
     def __init__(self, cnn_model: CNNModel):
         """
         Inicializar el servicio de detección
-        
+
         Args:
             cnn_model: Instancia del modelo CNN
         """
         self.cnn_model = cnn_model
         self.supported_formats = ['jpg', 'jpeg', 'png', 'dicom', 'dcm']
+        # Micro-batcher compartido: las peticiones concurrentes a /detect
+        # se agrupan antes de llegar al modelo
+        self._batcher = Batcher(self._predict_batch)
+        # Servidor de inferencia externo opcional (p.ej. Triton HTTP):
+        # si está configurado, este proceso actúa solo como gateway
+        self.inference_url = os.getenv("INFERENCE_URL")
+        self._inference_session: Optional[aiohttp.ClientSession] = None
+        # Cache LRU hash-de-bytes -> predicción: repetir la misma imagen
+        # (habitual al revisar un caso en la UI) no re-ejecuta el modelo
+        self._prediction_cache: OrderedDict = OrderedDict()
+        # Metadata DICOM por hash: un hit de predicción no repite el parse
+        # de cabeceras
+        self._metadata_cache: OrderedDict = OrderedDict()
+        # Warm-up en segundo plano: load_model ya calienta el forward de
+        # predict; aquí se ejerce además el camino de Grad-CAM (autograd,
+        # hooks, cuDNN del backward) para que la primera petición real no
+        # pague la especialización
+        if self.cnn_model.is_loaded:
+            try:
+                asyncio.get_running_loop().run_in_executor(_CPU_EXECUTOR, self._warmup_gradcam)
+            except RuntimeError:
+                # Sin event loop activo (scripts/tests síncronos): omitir
+                pass
+
+    def _warmup_gradcam(self):
+        """Forward+backward de Grad-CAM sobre una imagen dummy"""
+        try:
+            self.cnn_model.get_gradcam_heatmap(np.zeros((224, 224), dtype=np.uint8))
+            logger.info("Warm-up de Grad-CAM completado")
+        except Exception as e:
+            logger.debug(f"Warm-up de Grad-CAM omitido: {e}")
+
+    @property
+    def prediction_cache_size(self) -> int:
+        return len(self._prediction_cache)
+
+    async def _predict_batch(self, images: list) -> list:
+        """Procesar un lote de imágenes acumulado por el batcher"""
+        if self.inference_url:
+            return await self._predict_remote(images)
+        # Un único forward para todo el lote (apilado en el modelo)
+        return await self.cnn_model.predict_batch(images)
+
+    async def _predict_remote(self, images: list) -> list:
+        """
+        Delegar un lote al servidor de inferencia externo
+
+        El servidor recibe los arrays del lote y devuelve una lista de
+        predicciones en el mismo orden; la conexión se mantiene viva
+        entre peticiones.
+        """
+        if self._inference_session is None:
+            self._inference_session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+
+        payload = orjson.dumps({"inputs": images}, option=orjson.OPT_SERIALIZE_NUMPY)
+        async with self._inference_session.post(
+            self.inference_url,
+            data=payload,
+            headers={"Content-Type": "application/json"}
+        ) as response:
+            response.raise_for_status()
+            result = orjson.loads(await response.read())
+
+        return result["outputs"]
     
     async def detect_pneumonia(
-        self, 
-        image_data: bytes, 
+        self,
+        image_data: bytes,
         filename: str,
-        patient_info: Optional[Dict[str, Any]] = None
+        patient_info: Optional[Dict[str, Any]] = None,
+        want_heatmap: bool = True
     ) -> Dict[str, Any]:
         """
         Detectar neumonía en una radiografía
-        
+
         Args:
             image_data: Datos binarios de la imagen
             filename: Nombre del archivo
             patient_info: Información adicional del paciente
-            
+            want_heatmap: Si False se omite el Grad-CAM (un forward menos)
+
         Returns:
             Dict con resultados de detección
         """
@@ -57,20 +257,82 @@ class PneumoniaDetectionService:
             if file_extension not in self.supported_formats:
                 raise ValueError(f"Formato no soportado: {file_extension}")
             
-            # Procesar imagen según su tipo
-            image_array = await self._process_image(image_data, file_extension)
-            
-            # Realizar predicción con el modelo CNN
-            prediction_result = await self.cnn_model.predict(image_array)
+            # Predicción cacheada por hash del contenido: un hit evita el
+            # forward del modelo y el Grad-CAM completos
+            cache_key = hashlib.blake2b(image_data, digest_size=16).digest()
+            cached = self._prediction_cache.get(cache_key)
+            dicom_ds = None
+            if cached is not None and (not want_heatmap or "heatmap" in cached):
+                self._prediction_cache.move_to_end(cache_key)
+                prediction_result = dict(cached)
+                if not want_heatmap:
+                    prediction_result["heatmap"] = None
+                logger.info(f"Predicción servida desde cache para: {filename}")
+            else:
+                # Procesar imagen según su tipo (el dataset DICOM parseado
+                # se reutiliza después para la metadata)
+                image_array, dicom_ds = await self._process_image(image_data, file_extension)
 
-            # Generar heatmap Grad-CAM
-            heatmap_base64 = self.cnn_model.get_gradcam_heatmap(image_array)
-            prediction_result["heatmap"] = heatmap_base64
+                async with _INFER_SEM:
+                    if cached is not None:
+                        # Hit sin heatmap pero esta vez lo piden: solo Grad-CAM
+                        # (en el executor: son ~100-400ms de forward+backward)
+                        prediction_result = dict(cached)
+                        prediction_result["heatmap"] = await asyncio.get_running_loop().run_in_executor(
+                            _CPU_EXECUTOR,
+                            self.cnn_model.get_gradcam_heatmap,
+                            image_array,
+                            prediction_result.get("prob_neumonia"),
+                        )
+                    elif want_heatmap and not self.inference_url:
+                        # Predicción + Grad-CAM fusionados: un único forward
+                        # eager con tape produce logits y heatmap a la vez, en
+                        # lugar de un forward para predecir y otro para el mapa
+                        prediction_result = await asyncio.get_running_loop().run_in_executor(
+                            _CPU_EXECUTOR, self.cnn_model.predict_with_gradcam, image_array
+                        )
+                    else:
+                        # Realizar predicción con el modelo CNN (vía micro-batcher)
+                        prediction_result = await self._batcher.submit(image_array)
+                        if want_heatmap:
+                            prediction_result["heatmap"] = await asyncio.get_running_loop().run_in_executor(
+                                _CPU_EXECUTOR,
+                                self.cnn_model.get_gradcam_heatmap,
+                                image_array,
+                                prediction_result.get("prob_neumonia"),
+                            )
+                        else:
+                            prediction_result["heatmap"] = None
+
+                # Cachear sin la clave heatmap cuando no se calculó, para
+                # que una petición posterior con heatmap lo regenere
+                entry = dict(prediction_result)
+                if not want_heatmap:
+                    entry.pop("heatmap", None)
+                self._prediction_cache[cache_key] = entry
+                self._prediction_cache.move_to_end(cache_key)
+                if len(self._prediction_cache) > _PREDICTION_CACHE_MAX:
+                    self._prediction_cache.popitem(last=False)
             
             # Extraer información médica de la imagen si es DICOM
             dicom_metadata = None
             if file_extension in ['dicom', 'dcm']:
-                dicom_metadata = self._extract_dicom_metadata(image_data)
+                dicom_metadata = self._metadata_cache.get(cache_key)
+                if dicom_metadata is not None:
+                    self._metadata_cache.move_to_end(cache_key)
+                elif dicom_ds is not None:
+                    # Dataset ya parseado: el paseo por los tags es barato
+                    dicom_metadata = self._extract_dicom_metadata(image_data, dicom_ds)
+                else:
+                    # Sin dataset (hit de cache): el parse va al executor
+                    dicom_metadata = await asyncio.get_running_loop().run_in_executor(
+                        _CPU_EXECUTOR, self._extract_dicom_metadata, image_data
+                    )
+                if dicom_metadata is not None:
+                    self._metadata_cache[cache_key] = dicom_metadata
+                    self._metadata_cache.move_to_end(cache_key)
+                    if len(self._metadata_cache) > _PREDICTION_CACHE_MAX:
+                        self._metadata_cache.popitem(last=False)
             
             # Generar datos del caso para almacenamiento
             case_data = self._create_case_data(
@@ -102,63 +364,116 @@ class PneumoniaDetectionService:
             logger.error(f"Error en detección de neumonía: {e}")
             raise
     
-    async def _process_image(self, image_data: bytes, file_extension: str) -> np.ndarray:
+    async def _process_image(self, image_data: bytes, file_extension: str) -> tuple:
         """
         Procesar imagen según su formato
-        
+
         Args:
             image_data: Datos binarios de la imagen
             file_extension: Extensión del archivo
-            
+
         Returns:
-            np.ndarray: Array de imagen procesada
+            Tupla (array de imagen, dataset DICOM o None): el dataset
+            parseado se devuelve para que la extracción de metadata no
+            repita el dcmread completo
         """
         try:
+            # Decode y normalización corren en el executor: son C puro
+            # (OpenCV/pydicom/NumPy) que serializaría el event loop
+            loop = asyncio.get_running_loop()
             if file_extension in ['dicom', 'dcm']:
-                return self._process_dicom_image(image_data)
+                return await loop.run_in_executor(_CPU_EXECUTOR, self._decode_dicom, image_data)
             else:
-                return self._process_standard_image(image_data)
-                
+                image = await loop.run_in_executor(_CPU_EXECUTOR, self._decode_standard, image_data)
+                return image, None
+
         except Exception as e:
             logger.error(f"Error al procesar imagen: {e}")
             raise
-    
-    def _process_dicom_image(self, image_data: bytes) -> np.ndarray:
+
+    def _decode_dicom(self, image_data: bytes) -> tuple:
+        """Parse DICOM + extracción de píxeles (síncrono, en el executor);
+        un único dcmread por petición, compartido con la metadata"""
+        dicom_file = pydicom.dcmread(io.BytesIO(image_data))
+        return self._to_model_input(self._process_dicom_pixels(dicom_file)), dicom_file
+
+    def _decode_standard(self, image_data: bytes) -> np.ndarray:
+        """Decode estándar + reducción al tamaño del modelo (en el executor)"""
+        return self._to_model_input(self._process_standard_image(image_data))
+
+    def _to_model_input(self, image_array: np.ndarray) -> np.ndarray:
         """
-        Procesar imagen DICOM
-        
+        Center-crop + resize temprano a la entrada del modelo, con la misma
+        semántica que el preprocesado del modelo (crop cuadrado central,
+        INTER_AREA). Las etapas posteriores — hash del cache de tensores,
+        lote del batcher, Grad-CAM — trabajan así sobre ~50KB en lugar del
+        frame completo (hasta 3000x3000 en CR), y los FLOPs de conv bajan
+        con el área de entrada.
+        """
+        if image_array.ndim == 3:
+            image_array = image_array[:, :, 0]
+        h, w = image_array.shape
+        if h == w == _MODEL_INPUT_SIZE:
+            return image_array
+        size = min(h, w)
+        top = (h - size) // 2
+        left = (w - size) // 2
+        crop = image_array[top:top + size, left:left + size]
+        return cv2.resize(crop, (_MODEL_INPUT_SIZE, _MODEL_INPUT_SIZE), interpolation=cv2.INTER_AREA)
+
+    def _process_dicom_pixels(self, dicom_file) -> np.ndarray:
+        """
+        Extraer y normalizar el array de píxeles de un DICOM ya parseado
+
         Args:
-            image_data: Datos binarios del DICOM
-            
+            dicom_file: Dataset pydicom ya leído
+
         Returns:
             np.ndarray: Array de imagen
         """
         try:
-            # Leer DICOM desde bytes
-            import io
-            dicom_file = pydicom.dcmread(io.BytesIO(image_data))
-            
             # Extraer array de píxeles
             pixel_array = dicom_file.pixel_array
-            
-            # Normalizar valores de píxeles
-            if pixel_array.dtype != np.uint8:
-                # Normalizar a rango 0-255
-                pixel_array = pixel_array.astype(np.float64)
-                pixel_array = (pixel_array - pixel_array.min()) / (pixel_array.max() - pixel_array.min())
-                pixel_array = (pixel_array * 255).astype(np.uint8)
-            
-            # Aplicar windowing si está disponible
+
+            # Windowing y normalización fusionados en una única pasada
+            # float32 con operaciones in-place: antes se normalizaba por
+            # min-max (en float64, el doble de ancho de banda) y después
+            # se volvía a recorrer el array para el windowing. Con
+            # WindowCenter/WindowWidth presentes el min-max es redundante:
+            # la ventana define directamente el rango de salida.
+            center = width = None
             if hasattr(dicom_file, 'WindowCenter') and hasattr(dicom_file, 'WindowWidth'):
                 center = float(dicom_file.WindowCenter[0] if isinstance(dicom_file.WindowCenter, list) else dicom_file.WindowCenter)
                 width = float(dicom_file.WindowWidth[0] if isinstance(dicom_file.WindowWidth, list) else dicom_file.WindowWidth)
-                
-                min_val = center - width / 2
-                max_val = center + width / 2
-                
-                pixel_array = np.clip(pixel_array, min_val, max_val)
-                pixel_array = ((pixel_array - min_val) / (max_val - min_val) * 255).astype(np.uint8)
-            
+
+            if width:
+                # Ventana sobre los valores crudos: clip + escala in-place
+                lo = center - width / 2.0
+                if (
+                    _window_to_uint8_numba is not None
+                    and pixel_array.size >= _WINDOW_NUMBA_MIN_PIXELS
+                ):
+                    # Slice grande: bucle fusionado JIT, sin temporales
+                    pixel_array = _window_to_uint8_numba(
+                        pixel_array.astype(np.float32), lo, width
+                    )
+                else:
+                    tmp = pixel_array.astype(np.float32)
+                    np.clip(tmp, lo, lo + width, out=tmp)
+                    tmp -= lo
+                    tmp *= 255.0 / width
+                    np.rint(tmp, out=tmp)
+                    pixel_array = tmp.astype(np.uint8)
+            elif pixel_array.dtype != np.uint8:
+                # Min-max en una pasada float32
+                mn = float(pixel_array.min())
+                ptp = float(np.ptp(pixel_array))
+                tmp = pixel_array.astype(np.float32)
+                tmp -= mn
+                if ptp > 0:
+                    tmp *= 255.0 / ptp
+                pixel_array = tmp.astype(np.uint8)
+
             logger.info(f"Imagen DICOM procesada: {pixel_array.shape}")
             return pixel_array
             
@@ -177,6 +492,17 @@ class PneumoniaDetectionService:
             np.ndarray: Array de imagen
         """
         try:
+            # JPEG (sniff de los magic bytes) por libjpeg-turbo directo a gris
+            if _turbo_jpeg is not None and image_data[:3] == b'\xff\xd8\xff':
+                try:
+                    image = _turbo_jpeg.decode(image_data, pixel_format=TJPF_GRAY)
+                    if image.ndim == 3:
+                        image = image.squeeze(axis=2)
+                    logger.info(f"Imagen JPEG (turbojpeg) procesada: {image.shape}")
+                    return image
+                except Exception as e:
+                    logger.warning(f"TurboJPEG no pudo decodificar, usando cv2: {e}")
+
             # Convertir bytes a array numpy
             nparr = np.frombuffer(image_data, np.uint8)
             
@@ -193,45 +519,46 @@ class PneumoniaDetectionService:
             logger.error(f"Error al procesar imagen estándar: {e}")
             raise
     
-    def _extract_dicom_metadata(self, image_data: bytes) -> Optional[Dict[str, Any]]:
+    def _extract_dicom_metadata(self, image_data: bytes, dicom_file=None) -> Optional[Dict[str, Any]]:
         """
         Extraer metadata de imagen DICOM
-        
+
         Args:
             image_data: Datos binarios del DICOM
-            
+            dicom_file: Dataset ya parseado por _process_image (opcional);
+                si falta se parsea sin materializar el pixel data
+
         Returns:
             Dict con metadata extraída
         """
         try:
-            import io
-            dicom_file = pydicom.dcmread(io.BytesIO(image_data))
-            
-            metadata = {
-                "patient_id": getattr(dicom_file, 'PatientID', ''),
-                "patient_name": str(getattr(dicom_file, 'PatientName', '')),
-                "patient_age": getattr(dicom_file, 'PatientAge', ''),
-                "patient_sex": getattr(dicom_file, 'PatientSex', ''),
-                "study_date": getattr(dicom_file, 'StudyDate', ''),
-                "study_time": getattr(dicom_file, 'StudyTime', ''),
-                "modality": getattr(dicom_file, 'Modality', ''),
-                "institution": getattr(dicom_file, 'InstitutionName', ''),
-                "manufacturer": getattr(dicom_file, 'Manufacturer', ''),
-                "model": getattr(dicom_file, 'ManufacturerModelName', ''),
-                "body_part": getattr(dicom_file, 'BodyPartExamined', ''),
-                "view_position": getattr(dicom_file, 'ViewPosition', ''),
-                "image_size": f"{dicom_file.Rows}x{dicom_file.Columns}",
-                "pixel_spacing": getattr(dicom_file, 'PixelSpacing', []),
-                "slice_thickness": getattr(dicom_file, 'SliceThickness', ''),
-                "kvp": getattr(dicom_file, 'KVP', ''),
-                "exposure_time": getattr(dicom_file, 'ExposureTime', ''),
-                "window_center": getattr(dicom_file, 'WindowCenter', ''),
-                "window_width": getattr(dicom_file, 'WindowWidth', '')
-            }
-            
-            # Limpiar valores vacíos
-            metadata = {k: v for k, v in metadata.items() if v != ''}
-            
+            if dicom_file is None:
+                # Solo metadata: detener el parse antes del pixel data y
+                # decodificar únicamente los tags que se van a leer
+                dicom_file = pydicom.dcmread(
+                    io.BytesIO(image_data),
+                    stop_before_pixels=True,
+                    specific_tags=self._SPECIFIC_TAGS,
+                )
+
+            # Una pasada por la lista de tags; los valores vacíos se
+            # descartan directamente en lugar de filtrarlos a posteriori
+            metadata = {}
+            for key, tag, default in self._METADATA_TAGS:
+                try:
+                    value = dicom_file[tag].value
+                except KeyError:
+                    value = default
+                if key == "patient_name":
+                    value = str(value)
+                if value != '':
+                    metadata[key] = value
+
+            try:
+                metadata["image_size"] = f"{dicom_file[0x00280010].value}x{dicom_file[0x00280011].value}"
+            except KeyError:
+                pass
+
             logger.info("Metadata DICOM extraída correctamente")
             return metadata
             
@@ -260,25 +587,17 @@ class PneumoniaDetectionService:
         Returns:
             Dict con datos del caso
         """
-        # Determinar diagnosis basado en predicción
+        # Diagnóstico y severidad por lookup en la banda de confianza
         has_pneumonia = prediction_result.get('has_pneumonia', False)
         confidence = prediction_result.get('confidence', 0)
-        
-        diagnosis = "Neumonía" if has_pneumonia else "Normal"
-        if has_pneumonia and confidence >= 0.9:
-            diagnosis = "Neumonía probable"
-        elif has_pneumonia and confidence < 0.7:
-            diagnosis = "Neumonía posible"
-        
-        # Determinar severidad
-        severity = "ninguna"
+
         if has_pneumonia:
-            if confidence >= 0.9:
-                severity = "alta"
-            elif confidence >= 0.8:
-                severity = "moderada"
-            else:
-                severity = "leve"
+            band = sum(confidence >= t for t in _CONF_THRESHOLDS)
+            diagnosis = _DIAGNOSIS_TABLE[band]
+            severity = _SEVERITY_TABLE[band]
+        else:
+            diagnosis = "Normal"
+            severity = "ninguna"
         
         # Crear datos del caso
         case_data = {
@@ -321,8 +640,8 @@ class PneumoniaDetectionService:
         if has_pneumonia:
             case_data["findings"] = self._generate_findings(confidence, severity)
         else:
-            case_data["findings"] = "Campos pulmonares limpios, sin signos de consolidación o infiltrados"
-        
+            case_data["findings"] = _FINDINGS_NORMAL
+
         return case_data
     
     def _generate_findings(self, confidence: float, severity: str) -> str:
@@ -336,38 +655,8 @@ class PneumoniaDetectionService:
         Returns:
             str: Descripción de hallazgos
         """
-        base_findings = [
-            "Presencia de opacidades pulmonares",
-            "Signos sugestivos de proceso inflamatorio",
-            "Alteración del patrón pulmonar normal"
-        ]
-        
-        if severity == "alta":
-            findings = [
-                "Consolidación pulmonar evidente",
-                "Broncograma aéreo visible", 
-                "Opacidades densas con límites definidos",
-                "Probable derrame pleural asociado"
-            ]
-        elif severity == "moderada":
-            findings = [
-                "Infiltrados pulmonares parcheados",
-                "Opacidades de densidad intermedia",
-                "Patrón alveolar focal",
-                "Engrosamiento intersticial"
-            ]
-        else:  # leve
-            findings = [
-                "Opacidades sutiles en vidrio esmerilado",
-                "Infiltrados intersticiales mínimos",
-                "Cambios inflamatorios incipientes",
-                "Patrón reticular fino"
-            ]
-        
-        if confidence < 0.8:
-            findings.append("Hallazgos requieren correlación clínica")
-        
-        return ". ".join(findings) + "."
+        # Texto precomputado al importar el módulo: lookup O(1) por caso
+        return _FINDINGS[(severity if severity in _FINDINGS_ITEMS else "leve", confidence < 0.8)]
     
     def get_service_info(self) -> Dict[str, Any]:
         """Obtener información del servicio"""
@@ -375,6 +664,7 @@ class PneumoniaDetectionService:
             "service": "PneumoniaDetectionService",
             "version": "1.0.0",
             "supported_formats": self.supported_formats,
+            "prediction_cache_entries": self.prediction_cache_size,
             "model_status": "loaded" if self.cnn_model.is_loaded else "not_loaded",
             "model_info": self.cnn_model.get_model_info()
         } 
\ No newline at end of file
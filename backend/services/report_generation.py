@@ -5,11 +5,19 @@ Integración con MedGemma via Hugging Face para generación de informes
 
 import requests
 import json
+import hashlib
+import time
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional
 from loguru import logger
 from datetime import datetime
 import asyncio
 import aiohttp
+import orjson
+
+# Cache de informes: mismas entradas -> mismo informe, sin llamar al LLM
+_CACHE_TTL = 86400  # 24h
+_CACHE_MAX_ENTRIES = 256
 
 class ReportGenerationService:
     """Servicio para generación de informes médicos usando MedGemma"""
@@ -32,6 +40,25 @@ class ReportGenerationService:
         }
         self.max_retries = 3
         self.timeout = 60
+        # Sesión HTTP compartida: conexiones keep-alive reutilizadas
+        # entre llamadas en vez de abrir una sesión por intento
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Cache LRU de informes generados, keyed por hash del contenido
+        self._report_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Obtener la sesión HTTP compartida (se crea en el primer uso)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=50, keepalive_timeout=60)
+            )
+        return self._session
+
+    async def close(self):
+        """Cerrar la sesión HTTP compartida"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
         
     async def generate_medical_report(
         self,
@@ -53,7 +80,15 @@ class ReportGenerationService:
         """
         try:
             logger.info(f"Generando informe médico para caso: {detection_result.get('case_id', 'unknown')}")
-            
+
+            # Mismos inputs -> mismo informe: consultar cache antes del LLM
+            cache_key = self._cache_key(detection_result, patient_info, language)
+            cached = self._report_cache.get(cache_key)
+            if cached is not None and time.time() - cached[1] < _CACHE_TTL:
+                self._report_cache.move_to_end(cache_key)
+                logger.info("Informe recuperado del cache")
+                return cached[0]
+
             # Construir prompt contextual
             prompt = self._build_medical_prompt(
                 detection_result, patient_info, language
@@ -69,7 +104,12 @@ class ReportGenerationService:
             
             # Validar y enriquecer el informe
             final_report = self._validate_and_enrich_report(structured_report, detection_result)
-            
+
+            # Guardar en cache (solo informes generados con éxito)
+            self._report_cache[cache_key] = (final_report, time.time())
+            while len(self._report_cache) > _CACHE_MAX_ENTRIES:
+                self._report_cache.popitem(last=False)
+
             logger.success("Informe médico generado correctamente")
             return final_report
             
@@ -78,6 +118,23 @@ class ReportGenerationService:
             # Generar informe de fallback
             return self._generate_fallback_report(detection_result, patient_info)
     
+    @staticmethod
+    def _cache_key(
+        detection_result: Dict[str, Any],
+        patient_info: Optional[Dict[str, Any]],
+        language: str
+    ) -> str:
+        """Hash estable del contenido de la petición de informe"""
+        payload = orjson.dumps(
+            {
+                "detection_result": detection_result,
+                "patient_info": patient_info,
+                "language": language
+            },
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
     def _build_medical_prompt(
         self,
         detection_result: Dict[str, Any],
@@ -212,31 +269,31 @@ RADIOLOGICAL REPORT:"""
         
         for attempt in range(self.max_retries):
             try:
-                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                    async with session.post(
-                        self.api_url,
-                        headers=self.headers,
-                        json=payload
-                    ) as response:
-                        
-                        if response.status == 200:
-                            result = await response.json()
-                            if isinstance(result, list) and len(result) > 0:
-                                generated_text = result[0].get('generated_text', '')
-                                if generated_text:
-                                    logger.info("Texto generado exitosamente por MedGemma")
-                                    return generated_text
-                        
-                        elif response.status == 503:
-                            # Modelo cargándose
-                            wait_time = min(20 * (attempt + 1), 60)
-                            logger.warning(f"Modelo cargándose, esperando {wait_time}s...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        
-                        else:
-                            error_text = await response.text()
-                            logger.error(f"Error en API HuggingFace: {response.status} - {error_text}")
+                session = await self._get_session()
+                async with session.post(
+                    self.api_url,
+                    headers=self.headers,
+                    json=payload
+                ) as response:
+
+                    if response.status == 200:
+                        result = await response.json()
+                        if isinstance(result, list) and len(result) > 0:
+                            generated_text = result[0].get('generated_text', '')
+                            if generated_text:
+                                logger.info("Texto generado exitosamente por MedGemma")
+                                return generated_text
+
+                    elif response.status == 503:
+                        # Modelo cargándose
+                        wait_time = min(20 * (attempt + 1), 60)
+                        logger.warning(f"Modelo cargándose, esperando {wait_time}s...")
+                        await asyncio.sleep(wait_time)
+                        continue
+
+                    else:
+                        error_text = await response.text()
+                        logger.error(f"Error en API HuggingFace: {response.status} - {error_text}")
                             
             except asyncio.TimeoutError:
                 logger.warning(f"Timeout en intento {attempt + 1}")
@@ -13,6 +13,17 @@ from typing import Tuple, Optional, Dict, Any, Union
 from loguru import logger
 import base64
 
+# Tabla única de formatos soportados: extensión -> (MIME type, tamaño máximo)
+# Compartida entre la validación y el endpoint /supported-formats
+SUPPORTED_FORMATS = {
+    "jpg": ("image/jpeg", 10 << 20),
+    "jpeg": ("image/jpeg", 10 << 20),
+    "png": ("image/png", 10 << 20),
+    "dicom": ("application/dicom", 50 << 20),
+    "dcm": ("application/dicom", 50 << 20),
+}
+DICOM_EXTENSIONS = frozenset({"dicom", "dcm"})
+
 class ImageProcessor:
     """Clase para procesamiento de imágenes médicas"""
     
@@ -527,25 +538,37 @@ def validate_medical_image(image_data: bytes, filename: str) -> Dict[str, Any]:
     }
     
     try:
-        file_extension = filename.lower().split('.')[-1]
+        file_extension = filename.rsplit('.', 1)[-1].lower()
         validation_result["format"] = file_extension
-        
+
+        # Validar formato contra la tabla compartida
+        format_limits = SUPPORTED_FORMATS.get(file_extension)
+        if format_limits is None:
+            validation_result["errors"].append(f"Formato no soportado: {file_extension}")
+            return validation_result
+
         # Validar tamaño mínimo
         if len(image_data) < 1024:  # 1KB mínimo
             validation_result["errors"].append("Archivo demasiado pequeño")
             return validation_result
-        
-        # Validar tamaño máximo (50MB)
-        if len(image_data) > 50 * 1024 * 1024:
+
+        # Validar tamaño máximo según formato
+        if len(image_data) > format_limits[1]:
             validation_result["errors"].append("Archivo demasiado grande")
             return validation_result
-        
+
         # Validar formato y cargar imagen
-        if file_extension in ['dcm', 'dicom']:
-            dicom_file = pydicom.dcmread(io.BytesIO(image_data))
-            pixel_array = dicom_file.pixel_array
-            validation_result["dimensions"] = pixel_array.shape
-            
+        if file_extension in DICOM_EXTENSIONS:
+            # Solo cabecera: evita decodificar los píxeles (el elemento más
+            # pesado del fichero) para emitir el veredicto de validación
+            dicom_file = pydicom.dcmread(
+                io.BytesIO(image_data), stop_before_pixels=True, defer_size="1 KB"
+            )
+            rows = getattr(dicom_file, 'Rows', None)
+            columns = getattr(dicom_file, 'Columns', None)
+            if rows and columns:
+                validation_result["dimensions"] = (rows, columns)
+
             # Validaciones específicas DICOM
             if not hasattr(dicom_file, 'Modality'):
                 validation_result["warnings"].append("Sin información de modalidad")
@@ -0,0 +1,21 @@
+"""
+Respuesta JSON basada en orjson
+Serialización rápida para todas las respuestas de la API
+"""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse que serializa con orjson (numpy/datetime/UUID nativos)"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
@@ -0,0 +1,43 @@
+"""
+Respuestas JSON estáticas precomputadas
+Serializa payloads constantes una sola vez en el import y los sirve como
+bytes con soporte de ETag/304; la compresión queda en manos del
+GZipMiddleware de la app (comprimirlos aquí produciría gzip doble)
+"""
+
+import hashlib
+from typing import Any
+
+from fastapi import Request, status
+from fastapi.responses import Response
+import orjson
+
+
+class StaticJSON:
+    """Payload JSON constante serializado en el import"""
+
+    def __init__(self, payload: Any):
+        self.body = orjson.dumps(payload)
+        self.etag = f'"{hashlib.md5(self.body).hexdigest()}"'
+
+    def response(self, request: Request) -> Response:
+        """
+        Servir el payload con validación de ETag
+
+        Args:
+            request: Request entrante (If-None-Match)
+
+        Returns:
+            Response: 304 si el cliente ya tiene el contenido; si no,
+            200 con los bytes precomputados
+        """
+        headers = {"ETag": self.etag}
+
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(
+            content=self.body,
+            media_type="application/json",
+            headers=headers
+        )
@@ -83,7 +83,7 @@ main() {
     echo ""
     
     # Ejecutar uvicorn desde el directorio raíz
-    uvicorn backend.main:app --host 0.0.0.0 --port 8000 --reload
+    uvicorn backend.main:app --host 0.0.0.0 --port 8000 --reload --loop uvloop --http httptools
 }
 
 # Capturar Ctrl+C para parada limpia
@@ -8,7 +8,7 @@
 export PYTHONPATH=$(pwd)
 
 # Levantar backend desde la raíz
-(uvicorn backend.main:app --reload --host 0.0.0.0 --port 8000) &
+(uvicorn backend.main:app --reload --host 0.0.0.0 --port 8000 --loop uvloop --http httptools) &
 BACK_PID=$!
 
 # Levantar frontend moderno
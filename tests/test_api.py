@@ -132,6 +132,102 @@ class TestValidation:
         assert "is_valid" in data
         assert "quality_score" in data
 
+class TestMultipartUpload:
+    """Pruebas para el protocolo de subida multipart de estudios"""
+
+    def _begin(self, filename="estudio.png"):
+        return client.post(
+            "/api/v1/studies/upload/begin",
+            data={"patient_id": "p_test", "filename": filename}
+        )
+
+    def _cleanup(self, upload_id):
+        """Borrar el directorio de partes que la prueba deja a medias"""
+        import shutil
+        from backend.api.routes.studies import PARTS_PATH
+        shutil.rmtree(os.path.join(PARTS_PATH, upload_id), ignore_errors=True)
+
+    def test_begin_returns_upload_id_and_part_size(self):
+        """Probar inicio de subida multipart"""
+        response = self._begin()
+        assert response.status_code == 200
+        data = response.json()
+        assert "upload_id" in data
+        assert data["part_size"] > 0
+        self._cleanup(data["upload_id"])
+
+    def test_begin_rejects_bad_extension(self):
+        """Probar rechazo de extensiones no permitidas"""
+        response = self._begin("script.exe")
+        assert response.status_code == 415
+
+    def test_part_upload_unknown_id(self):
+        """Probar subida de parte a un upload_id inexistente"""
+        response = client.put("/api/v1/studies/upload/no-es-uuid/0", content=b"datos")
+        assert response.status_code == 404
+
+    def test_part_rejects_oversized_body(self):
+        """Probar el límite de tamaño por parte"""
+        from backend.api.routes.studies import UPLOAD_PART_SIZE
+        upload_id = self._begin().json()["upload_id"]
+        response = client.put(
+            f"/api/v1/studies/upload/{upload_id}/0",
+            content=b"x" * (UPLOAD_PART_SIZE + 1)
+        )
+        assert response.status_code == 413
+        self._cleanup(upload_id)
+
+    def test_complete_detects_missing_parts(self):
+        """Probar detección de partes faltantes al completar"""
+        upload_id = self._begin().json()["upload_id"]
+        assert client.put(f"/api/v1/studies/upload/{upload_id}/0", content=b"a" * 10).status_code == 200
+        assert client.put(f"/api/v1/studies/upload/{upload_id}/2", content=b"b" * 10).status_code == 200
+        response = client.post(f"/api/v1/studies/upload/{upload_id}/complete")
+        assert response.status_code == 400
+        assert "Faltan partes" in response.json()["detail"]
+        self._cleanup(upload_id)
+
+    def test_complete_unknown_upload(self):
+        """Probar completar una subida inexistente"""
+        import uuid
+        response = client.post(f"/api/v1/studies/upload/{uuid.uuid4()}/complete")
+        assert response.status_code == 404
+
+    def test_complete_enforces_total_size_cap(self):
+        """Probar el límite de tamaño total del archivo"""
+        from backend.api.routes.studies import PARTS_PATH
+        from backend.config.settings import get_settings
+        upload_id = self._begin().json()["upload_id"]
+        assert client.put(f"/api/v1/studies/upload/{upload_id}/0", content=b"x" * 100).status_code == 200
+        with patch.object(get_settings(), "max_file_size", 10):
+            response = client.post(f"/api/v1/studies/upload/{upload_id}/complete")
+        assert response.status_code == 413
+        # El servidor descarta las partes rechazadas: no queda directorio
+        assert not os.path.isdir(os.path.join(PARTS_PATH, upload_id))
+
+    def test_complete_concatenates_parts_and_creates_study(self):
+        """Probar el camino completo begin -> partes -> complete"""
+        from backend.api.routes.studies import IMAGES_PATH
+        upload_id = self._begin().json()["upload_id"]
+        payload = b"\x89PNG" + b"\x00" * 100
+        assert client.put(f"/api/v1/studies/upload/{upload_id}/0", content=payload[:52]).status_code == 200
+        assert client.put(f"/api/v1/studies/upload/{upload_id}/1", content=payload[52:]).status_code == 200
+        response = client.post(f"/api/v1/studies/upload/{upload_id}/complete")
+        assert response.status_code == 200
+        study = response.json()
+        assert study["patient_id"] == "p_test"
+        assert study["filename"].endswith("estudio.png")
+        # El archivo concatenado contiene las partes en orden
+        image_path = os.path.join(IMAGES_PATH, study["filename"])
+        with open(image_path, 'rb') as f:
+            assert f.read() == payload
+        # Limpieza: borrar el estudio y la imagen creados por la prueba
+        client.delete(f"/api/v1/studies/{study['id']}")
+        try:
+            os.remove(image_path)
+        except OSError:
+            pass
+
 # Fixtures para pruebas
 @pytest.fixture
 def sample_image_file():
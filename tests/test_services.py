@@ -0,0 +1,108 @@
+"""
+Pruebas para servicios de RADOX
+Pruebas unitarias para el micro-batcher y el plegado del log de estudios
+"""
+
+import pytest
+import asyncio
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.services.batching import Batcher
+from backend.api.routes.studies import _fold_log
+
+class TestBatcher:
+    """Pruebas para el micro-batcher de inferencia"""
+
+    def test_results_preserve_order(self):
+        """Cada submit recibe el resultado de su propio item"""
+        async def scenario():
+            async def process(items):
+                return [item * 2 for item in items]
+
+            batcher = Batcher(process, max_batch=4, window_ms=5)
+            return await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+
+        assert asyncio.run(scenario()) == [i * 2 for i in range(10)]
+
+    def test_requests_are_grouped(self):
+        """Peticiones concurrentes se agrupan sin superar max_batch"""
+        async def scenario():
+            sizes = []
+
+            async def process(items):
+                sizes.append(len(items))
+                return items
+
+            batcher = Batcher(process, max_batch=4, window_ms=50)
+            await asyncio.gather(*(batcher.submit(i) for i in range(8)))
+            return sizes
+
+        sizes = asyncio.run(scenario())
+        assert sum(sizes) == 8
+        assert max(sizes) <= 4
+        assert len(sizes) < 8  # Hubo agrupación, no 8 lotes de 1
+
+    def test_errors_propagate_to_all_waiters(self):
+        """Un fallo del lote llega como excepción a cada submit"""
+        async def scenario():
+            async def process(items):
+                raise RuntimeError("modelo caído")
+
+            batcher = Batcher(process, max_batch=4, window_ms=5)
+            return await asyncio.gather(
+                *(batcher.submit(i) for i in range(3)),
+                return_exceptions=True
+            )
+
+        results = asyncio.run(scenario())
+        assert len(results) == 3
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+class TestFoldLog:
+    """Pruebas para el plegado del log JSONL de estudios"""
+
+    def test_fold_insert_and_overwrite(self):
+        """La última alta del mismo id gana (last-write-wins)"""
+        records = [
+            {"id": "a", "patient_id": "p1", "descripcion": "v1"},
+            {"id": "b", "patient_id": "p1"},
+            {"id": "a", "patient_id": "p1", "descripcion": "v2"},
+        ]
+        studies = {s["id"]: s for s in _fold_log(records)}
+        assert set(studies) == {"a", "b"}
+        assert studies["a"]["descripcion"] == "v2"
+
+    def test_fold_patch_updates_existing(self):
+        """Un tombstone patch actualiza campos sin duplicar el estudio"""
+        records = [
+            {"id": "a", "patient_id": "p1", "diagnostico": None},
+            {"_op": "patch", "id": "a", "diagnostico": "Neumonía", "confianza": 0.91},
+        ]
+        studies = _fold_log(records)
+        assert len(studies) == 1
+        assert studies[0]["diagnostico"] == "Neumonía"
+        assert studies[0]["confianza"] == 0.91
+        assert "_op" not in studies[0]
+
+    def test_fold_delete_removes_study(self):
+        """Un tombstone del elimina el estudio del estado plegado"""
+        records = [
+            {"id": "a", "patient_id": "p1"},
+            {"id": "b", "patient_id": "p2"},
+            {"_op": "del", "id": "a"},
+        ]
+        studies = _fold_log(records)
+        assert [s["id"] for s in studies] == ["b"]
+
+    def test_fold_ignores_orphan_tombstones(self):
+        """Patch/del sobre ids inexistentes no rompen el plegado"""
+        records = [
+            {"_op": "del", "id": "fantasma"},
+            {"_op": "patch", "id": "fantasma", "diagnostico": "x"},
+            {"id": "a", "patient_id": "p1"},
+        ]
+        studies = _fold_log(records)
+        assert [s["id"] for s in studies] == ["a"]